@@ -12,18 +12,28 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 def create_app():
     app = Flask(__name__)
     app.secret_key = SECRET_KEY
+    # static files may be cached publicly by browsers and the edge
+    app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 3600
 
 
     from blueprints.account import return_account_blueprint
     from blueprints.game import return_game_blueprint
+    from blueprints.api import return_api_blueprint
+    from storage import ManagerCache, create_store
+
+    # one connection pool and one cache of loaded games per worker, shared by the blueprints
+    store = create_store()
+    cache = ManagerCache(store, int(os.getenv("GAME_CACHE_SIZE", 256)))
 
     account_bp = return_account_blueprint()
-    game_bp = return_game_blueprint()
+    game_bp = return_game_blueprint(store, cache)
+    api_bp = return_api_blueprint(store, cache)
 
     # THIS is the important line
 
     app.register_blueprint(account_bp)
     app.register_blueprint(game_bp, url_prefix='/<username>/game')
+    app.register_blueprint(api_bp)
 
 
     # this create first user + game session
@@ -0,0 +1,71 @@
+# cold start cost, each measurement runs in a fresh interpreter like a new serverless instance
+# run from anywhere: python benchmarks/import_time.py [runs] [--budget-ms MS]
+import argparse, json, os, statistics, subprocess, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# every probe prints a json dict of milliseconds
+PROBES = {
+    "import assemble": """
+import time
+t = time.perf_counter()
+import assemble
+print({"ms": (time.perf_counter() - t) * 1000})
+""",
+    "import app (create_app)": """
+import time
+t = time.perf_counter()
+import app
+print({"ms": (time.perf_counter() - t) * 1000})
+""",
+    "first world access, snapshot": """
+import time, main
+t = time.perf_counter()
+main.get_cities()
+print({"ms": (time.perf_counter() - t) * 1000})
+""",
+    "first world access, no snapshot": """
+import os, time, main
+os.environ["WORLD_SNAPSHOT"] = os.path.join(os.environ["SCRATCH"], "missing", "world.snapshot")
+import world
+world.fallback_path = lambda source_hash: os.path.join(os.environ["SCRATCH"], "missing", "fallback.snapshot")
+t = time.perf_counter()
+main.get_cities()
+print({"ms": (time.perf_counter() - t) * 1000})
+""",
+}
+
+
+def run_probe(code: str, env: dict) -> float:
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    # the game prints to stdout while loading, the measurement is the last line
+    return json.loads(out.strip().splitlines()[-1].replace("'", '"'))["ms"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kaltstartzeit des Spiels messen")
+    parser.add_argument("runs", type=int, nargs="?", default=5)
+    parser.add_argument("--budget-ms", type=float, help="Fehlercode 1, wenn 'import app' im Median länger braucht")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        env = dict(os.environ, STORAGE_URL="memory://", SCRATCH=scratch, PYTHONDONTWRITEBYTECODE="1")
+        env.pop("WORLD_SNAPSHOT", None)
+        # make sure the snapshot is current and bytecode is compiled, neither should count
+        subprocess.run([sys.executable, "world.py"], cwd=ROOT, env=env, check=True, capture_output=True)
+        subprocess.run([sys.executable, "-c", "import app"], cwd=ROOT, env=dict(env, PYTHONDONTWRITEBYTECODE=""), check=True, capture_output=True)
+
+        medians = {}
+        for name, code in PROBES.items():
+            times = [run_probe(code, env) for _ in range(args.runs)]
+            medians[name] = statistics.median(times)
+            print(f"{name:32} {medians[name]:8.1f} ms  (min {min(times):.1f}, max {max(times):.1f})")
+
+    if args.budget_ms is not None and medians["import app (create_app)"] > args.budget_ms:
+        print(f"'import app' über dem Budget von {args.budget_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
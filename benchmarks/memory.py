@@ -0,0 +1,44 @@
+# memory footprint of the domain objects a hydrated AirlineManager keeps alive
+# run from anywhere: python benchmarks/memory.py [count]
+import os, sys, tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT) # main.py loads cities.csv and planes/ relative to the working directory
+sys.path.insert(0, ROOT)
+
+from main import Plane, Flight, Instant, get_cities, get_models
+
+
+def measure(build, count: int) -> float:
+    """Average bytes allocated per object built by build(i), including everything it owns"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [build(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # the list holding the objects is not part of their cost
+    return (after - before - sys.getsizeof(objects)) / len(objects)
+
+
+def main(count: int = 10000):
+    cities = get_cities()
+    model = get_models()[0]
+    planes = [Plane(model, f"P{i}") for i in range(len(cities))]
+
+    def build_plane(i):
+        plane = Plane(model, f"D-{i:05d}")
+        plane.current_city = cities[i % len(cities)]
+        return plane
+
+    def build_flight(i):
+        start = Instant.from_minutes(i % Instant.MINUTES_PER_WEEK)
+        return Flight(cities[i % len(cities)], cities[(i + 1) % len(cities)], planes[i % len(planes)], start, 30)
+
+    # registrations and start instants are created per object, as when a game is loaded
+    print(f"{'object':<8} {'bytes':>8}")
+    print(f"{'plane':<8} {measure(build_plane, count):>8.0f}")
+    print(f"{'flight':<8} {measure(build_flight, count):>8.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,186 @@
+# timings of the simulation and persistence hot paths on synthetic airlines
+# run from anywhere:
+#   python benchmarks/run.py                                  10, 100 and 1000 planes, ~20 flights each
+#   python benchmarks/run.py --save-baseline                  keep the results as benchmarks/baseline.json
+#   python benchmarks/run.py --compare                        fail if a path got slower than the baseline
+import argparse, contextlib, gc, io, json, os, platform, statistics, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT) # main.py loads cities.csv and planes/ relative to the working directory
+sys.path.insert(0, ROOT)
+
+from main import AirlineManager, Instant, get_week_demand
+from codec import encode_sections, decode_sections
+
+RESULTS_PATH = os.path.join("benchmarks", "results.json")
+BASELINE_PATH = os.path.join("benchmarks", "baseline.json")
+TURNAROUND = 45 # minutes on the ground between two flights of a plane
+NOISE_MS = 0.5 # slowdowns smaller than this are never reported as regressions
+SAMPLE_BUDGET_MS = 500 # every path is called until its calls took this long together ...
+MAX_CALLS = 200 # ... or this often
+
+
+def build_airline(planes: int, flights_per_plane: int) -> AirlineManager:
+    """An airline with planes of the longest-range model, each flying round trips on one route.
+
+    Deterministic: the same arguments always give the same airline and a valid flight plan.
+    """
+    manager = AirlineManager()
+    manager.money = 1e15 # enough for any fleet size
+    hub_cities = [hub.city for hub in manager.hubs]
+    model = max(manager.available_models, key=lambda m: (m.range, m.capacity))
+
+    # shortest routes first, they fit the most flights into a week
+    routes = sorted(((a, b) for a in hub_cities for b in hub_cities if a != b and a.distance_to(b) <= model.range),
+                    key=lambda route: route[0].distance_to(route[1]))
+
+    for i in range(planes):
+        origin, destination = routes[i % len(routes)]
+        plane = manager.buy_plane(model.name, f"B-{i:05d}", origin)
+        start = i % 60
+        for n in range(flights_per_plane):
+            duration = round(origin.distance_to(destination) / plane.velocity)
+            if start + duration >= Instant.MINUTES_PER_WEEK:
+                break
+            manager.create_flight(origin.short, destination.short, plane.registration, Instant.from_minutes(start), plane.capacity)
+            start += duration + TURNAROUND
+            origin, destination = destination, origin
+    # the starter plane stays on the ground
+    return manager
+
+
+def reference(_=None):
+    """A fixed pure Python workload of a few milliseconds, the yardstick for every path"""
+    total = 0
+    for i in range(20_000):
+        total += i * i % 7
+    return sorted(str(i) for i in range(2_000))
+
+
+def timed(run, setup=None, repeats: int = 5) -> dict:
+    """Median and best time of run(setup()), in milliseconds, after one warm-up call.
+
+    Called at least repeats times and until the calls took SAMPLE_BUDGET_MS
+    together. On a busy machine only the best of many calls is stable, and
+    fast paths get many calls from the budget. setup() is never timed.
+
+    Every call is followed by a call of reference(). relative is the best time
+    divided by the best reference time: the machine's speed drifts over
+    seconds, and both are measured at the same speed.
+    """
+    def call(function, argument=None) -> float:
+        gc.collect()
+        gc.disable() # like timeit, a collection would be charged to whatever runs at that moment
+        try:
+            with contextlib.redirect_stdout(io.StringIO()): # the game prints progress
+                started = time.perf_counter()
+                function(argument)
+                return (time.perf_counter() - started) * 1000
+        finally:
+            gc.enable()
+
+    call(run, setup() if setup else None)
+    times, reference_times = [], []
+    while len(times) < repeats or (sum(times) < SAMPLE_BUDGET_MS and len(times) < MAX_CALLS):
+        times.append(call(run, setup() if setup else None))
+        reference_times.append(call(reference))
+    return {"median_ms": statistics.median(times), "min_ms": min(times), "calls": len(times),
+            "relative": min(times) / min(reference_times)}
+
+
+def bench_scale(planes: int, flights_per_plane: int, repeats: int) -> dict:
+    manager = build_airline(planes, flights_per_plane)
+    data = manager.to_dict()
+    sections = encode_sections(manager, AirlineManager.SECTIONS)
+    copy = lambda: AirlineManager.from_dict(data)
+
+    def create_flights(empty):
+        for flight in manager.flights:
+            empty.create_flight(flight.origin.short, flight.destination.short, flight.plane.registration, flight.start, flight.passengers)
+
+    without_flights = lambda: AirlineManager.from_dict({**data, "flights": []})
+
+    def cold_demand(airline):
+        get_week_demand.cache_clear()
+        airline.update_demand()
+
+    results = {
+        "flights": len(manager.flights),
+        "to_dict": timed(lambda _: manager.to_dict(), repeats=repeats),
+        "from_dict": timed(lambda _: AirlineManager.from_dict(data), repeats=repeats),
+        "encode_sections": timed(lambda _: encode_sections(manager, AirlineManager.SECTIONS), repeats=repeats),
+        "decode_sections": timed(lambda _: decode_sections(sections), repeats=repeats),
+        "create_flight": timed(create_flights, without_flights, repeats),
+        "check_flight_plan": timed(lambda _: manager.check_flight_plan(), repeats=repeats),
+        "update_demand": timed(cold_demand, copy, repeats),
+        "recalculate_flights": timed(lambda airline: airline.recalculate_flights(), copy, repeats),
+        "advance_week": timed(lambda airline: airline.advance_week(), copy, repeats),
+    }
+    if manager.check_flight_plan():
+        raise RuntimeError("synthetische Airline hat einen ungültigen Flugplan")
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Paths that got more than threshold times slower than in the baseline.
+
+    Compares the relative times, the best run of a path measured against the
+    reference workload next to it, so a faster or busier machine does not show
+    up as a regression everywhere. Slowdowns below NOISE_MS are ignored.
+    """
+    regressions = []
+    for scale, paths in results["scales"].items():
+        for path, timing in paths.items():
+            before = baseline["scales"].get(scale, {}).get(path)
+            if not isinstance(timing, dict) or not before or "relative" not in before:
+                continue
+            ratio = timing["relative"] / before["relative"]
+            print(f"{scale:>12} {path:<20} {before['min_ms']:10.2f} -> {timing['min_ms']:10.2f} ms  x{ratio:.2f}")
+            if ratio > threshold and before["min_ms"] * (ratio - 1) > NOISE_MS:
+                regressions.append((scale, path, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks der Simulation und Speicherung")
+    parser.add_argument("--planes", default="10,100,1000", help="Flottengrößen, kommagetrennt")
+    parser.add_argument("--flights-per-plane", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Ergebnisse auch als Baseline speichern")
+    parser.add_argument("--compare", action="store_true", help="mit der Baseline vergleichen, Fehlercode 1 bei Regression")
+    parser.add_argument("--threshold", type=float, default=1.25, help="erlaubter Faktor gegenüber der Baseline")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "flights_per_plane": args.flights_per_plane,
+        "repeats": args.repeats,
+        "scales": {},
+    }
+    for planes in (int(n) for n in args.planes.split(",")):
+        scale = results["scales"][f"{planes} planes"] = bench_scale(planes, args.flights_per_plane, args.repeats)
+        print(f"{planes} Flugzeuge, {scale['flights']} Flüge")
+        for path, timing in scale.items():
+            if isinstance(timing, dict):
+                print(f"  {path:<20} {timing['median_ms']:10.2f} ms  (min {timing['min_ms']:.2f})")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            for scale, path, ratio in regressions:
+                print(f"Regression: {path} bei {scale} x{ratio:.2f}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# read-only JSON api of a game, for clients that update parts of a page themselves
+#   GET /<username>/api/v1/fleet
+#   GET /<username>/api/v1/schedule          (whole week)
+#   GET /<username>/api/v1/schedule/<day>
+#   GET /<username>/api/v1/routes/<origin>/<destination>?step=60
+#   GET /<username>/api/v1/pnl
+# every endpoint takes ?fields=a,b to return only those fields
+import functools
+from typing import Dict, List, Optional
+from flask import Blueprint, Response, g, request, abort
+import msgspec
+
+from main import Instant, passenger_demand_curve
+from storage import GameStore, ManagerCache
+from blueprints.game import revalidate
+
+
+class PlaneInfo(msgspec.Struct):
+    registration: str
+    model: str
+    capacity: int
+    range: float
+    velocity: float
+    current_city: Optional[str]
+    flights: int
+
+
+class FlightInfo(msgspec.Struct):
+    start: str # as the calendar's delete form expects it
+    start_minutes: int # minute of the week
+    end_minutes: int
+    origin: str
+    destination: str
+    plane: str
+    passengers: int
+    duration: int
+    revenue: float
+    cost: float
+    profit: float
+
+
+class RouteInfo(msgspec.Struct):
+    origin: str
+    destination: str
+    distance: float
+    demand: Optional[int]
+    step: int # minutes between two values of curve
+    curve: List[int]
+
+
+class ProfitInfo(msgspec.Struct):
+    week: int
+    money: float
+    flights: int
+    revenue: float
+    flight_cost: float
+    flight_profit: float
+    maintenance: float
+    hub_cost: float
+    expected_profit: float
+    day_profit: Dict[str, float]
+
+
+_encoder = msgspec.json.Encoder()
+
+
+def select_fields(data, struct_type):
+    """Only the fields named in ?fields= of a struct or a list of them, all if there is none"""
+    fields = [name for name in request.args.get('fields', '').split(',') if name]
+    if not fields:
+        return data
+    unknown = set(fields) - set(struct_type.__struct_fields__)
+    if unknown:
+        abort(json_error(f"Unbekannte Felder: {', '.join(sorted(unknown))}", 400))
+    if isinstance(data, list):
+        return [{name: getattr(item, name) for name in fields} for item in data]
+    return {name: getattr(data, name) for name in fields}
+
+
+def json_response(data, status: int = 200) -> Response:
+    return Response(_encoder.encode(data), status=status, mimetype="application/json")
+
+
+def json_error(message: str, status: int) -> Response:
+    return json_response({"error": message}, status)
+
+
+def flight_info(flight) -> FlightInfo:
+    return FlightInfo(str(flight.start), flight.start.to_minutes(), flight.end.to_minutes(),
+                      flight.origin.short, flight.destination.short, flight.plane.registration,
+                      flight.passengers, flight.duration, flight.revenue,
+                      flight.variable_cost + flight.fixed_cost, flight.profit)
+
+
+def return_api_blueprint(store: GameStore, cache: ManagerCache):
+    api_bp = Blueprint('api', __name__, url_prefix='/<username>/api/v1')
+
+    @api_bp.before_request
+    def load_user():
+        g.user_id = request.view_args.get("username") or "demo"
+
+    def game_view(view):
+        """Passes the player's game to view, answers If-None-Match with 304 while it is unchanged"""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            version = store.read_version(g.user_id)
+            if version is None:
+                return json_error("Spiel nicht gefunden", 404)
+
+            def render():
+                manager = cache.load(g.user_id, version)
+                if manager is None:
+                    return json_error("Spiel nicht gefunden", 404)
+                return view(manager, *args, **kwargs)
+            return revalidate(g.user_id, version, render)
+        return wrapper
+
+    @api_bp.route('/fleet')
+    @game_view
+    def fleet(manager, username):
+        planes = [PlaneInfo(p.registration, p.model.name, p.capacity, p.range, p.velocity,
+                            p.current_city.short if p.current_city else None, len(p.flights))
+                  for p in manager.planes]
+        return json_response(select_fields(planes, PlaneInfo))
+
+    @api_bp.route('/schedule')
+    @api_bp.route('/schedule/<day>')
+    @game_view
+    def schedule(manager, username, day=None):
+        if day is not None and day not in Instant.DAYS:
+            return json_error("Unbekannter Tag", 404)
+        flights = [f for f in manager.flights if day is None or f.start.day == day]
+        flights.sort(key=lambda f: f.start.to_minutes())
+        return json_response(select_fields([flight_info(f) for f in flights], FlightInfo))
+
+    @api_bp.route('/routes/<origin>/<destination>')
+    @game_view
+    def route(manager, origin, destination, username):
+        origin_city = manager.find_city(origin)
+        destination_city = manager.find_city(destination)
+        if not origin_city or not destination_city:
+            return json_error("Stadt nicht gefunden", 404)
+        step = min(max(request.args.get('step', 60, type=int), 1), Instant.MINUTES_PER_DAY)
+        demand = manager.demand.route(origin_city, destination_city)
+        curve = passenger_demand_curve(demand, origin_city.timezone, step) if demand is not None else []
+        info = RouteInfo(origin_city.short, destination_city.short, origin_city.distance_to(destination_city),
+                         demand, step, curve)
+        return json_response(select_fields(info, RouteInfo))
+
+    @api_bp.route('/pnl')
+    @game_view
+    def pnl(manager, username):
+        totals = manager.flight_totals
+        maintenance = manager.calculate_weekly_maintenance()
+        hub_cost = manager.calculate_weekly_hub_cost()
+        info = ProfitInfo(manager.week, manager.money, totals.flights, totals.revenue, totals.cost, totals.profit,
+                          maintenance, hub_cost, totals.profit - maintenance - hub_cost,
+                          {day: manager.day_totals[day].profit for day in Instant.DAYS})
+        return json_response(select_fields(info, ProfitInfo))
+
+    return api_bp
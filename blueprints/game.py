@@ -1,11 +1,72 @@
-from flask import Blueprint, json, render_template, g, redirect, url_for, request, app
-import redis, os
-from main import AirlineManager, Instant, Hub, get_potential_passenger_demand, get_route_demand
+import functools, hashlib, os
+from pathlib import Path
+from flask import Blueprint, render_template, g, redirect, url_for, request, jsonify, make_response, current_app
+from main import AirlineManager, Instant, passenger_demand_curve
+from search import search_cities
+from storage import ConflictError, GameStore, ManagerCache, create_store
+from world import source_hash
 from dotenv import load_dotenv
 
+MAX_SIMULATED_WEEKS = 52 # per request, weeks are simulated in memory and saved once
+MAX_SAVE_ATTEMPTS = 5 # per request, when other requests keep saving the same game
+RANKING_PAGE_SIZE = 100 # demand partners per page on the city view
+CITIES_PAGE_SIZE = 40 # search results per page on the cities tab
+CATALOG_MAX_AGE = 3600 # seconds browsers and the edge may keep pages without any game state
 
-def return_game_blueprint():
-    r = redis.from_url(os.getenv("REDIS_URL"))
+
+def code_release() -> str:
+    """Hash of the code, the templates and the game world, the same in every worker running them"""
+    root = Path(__file__).resolve().parent.parent
+    digest = hashlib.blake2b(source_hash().encode(), digest_size=16)
+    for pattern in ("*.py", "blueprints/*.py", "templates/**/*.html"):
+        for path in sorted(root.glob(pattern)):
+            digest.update(path.relative_to(root).as_posix().encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+# part of every ETag, so a new deployment never answers with pages rendered by the old one
+RELEASE = os.getenv("VERCEL_GIT_COMMIT_SHA") or os.getenv("RELEASE") or code_release()
+
+
+def game_etag(user_id: str, version: int) -> str:
+    # the version changes with every save, including every new week
+    return hashlib.blake2b(f"{RELEASE}:{user_id}:{version}".encode(), digest_size=12).hexdigest()
+
+
+def revalidate(user_id: str, version: int, render):
+    """304 if the client already has this version of the game, otherwise the response of render().
+
+    Game pages and api responses are private to the player and revalidated on
+    every request. The ETag is compared weakly (RFC 9110), proxies that
+    compress may weaken it.
+    """
+    etag = game_etag(user_id, version)
+    if request.if_none_match.contains_weak(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(render())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def paginate(items: list, page: int, per_page: int) -> dict:
+    """One page of items, page numbers out of range show the nearest page"""
+    pages = max(1, -(-len(items) // per_page))
+    page = min(max(page, 1), pages)
+    return {"items": items[(page - 1) * per_page:page * per_page], "page": page, "pages": pages}
+
+
+def return_game_blueprint(store: GameStore = None, cache: ManagerCache = None):
+    if store is None:
+        store = create_store()
+    if cache is None:
+        # hydrated games of this worker for pages that only read them
+        cache = ManagerCache(store, int(os.getenv("GAME_CACHE_SIZE", 256)))
 
     game_bp = Blueprint('game', __name__)
 
@@ -17,31 +78,74 @@ def return_game_blueprint():
             abort(404)
         g.user_id = username
 
-    def get_manager():
-        user_id = g.user_id
-        key = f"game:{user_id}"
-
-        data = r.get(key)
-        if data is None:
+    def load_manager(load):
+        manager = load(g.user_id)
+        if manager is None:
             manager = AirlineManager()
-            save_manager(manager)
-            return manager
+            try:
+                store.save(g.user_id, manager)
+            except ConflictError:
+                # created by a parallel request in the meantime
+                manager = load(g.user_id)
+        return manager
 
-        return AirlineManager.from_dict(json.loads(data))
+    def get_manager():
+        """The game for reading only, possibly shared with other requests of this worker"""
+        return load_manager(lambda user_id: cache.load(user_id, g.get("version")))
+
+    def conditional(view):
+        """Answers If-None-Match with 304 while the game is unchanged, before it is loaded or rendered.
+
+        For pages that only show the game; they are private to the player and
+        revalidated on every visit. Other methods than GET and HEAD are passed through.
+        """
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(*args, **kwargs)
+            version = store.read_version(g.user_id)
+            if version is None:
+                return view(*args, **kwargs) # new game, created by the view
+
+            def render():
+                g.version = version
+                return view(*args, **kwargs)
+            return revalidate(g.user_id, version, render)
+        return wrapper
 
 
     def save_manager(manager):
-        user_id = g.user_id
-        key = f"game:{user_id}"
-        r.set(key, json.dumps(manager.to_dict()))
+        store.save(g.user_id, manager)
+        cache.put(g.user_id, manager)
+
+    def update_manager(change):
+        """Loads the game, applies change(manager) and saves it, returns (manager, result of change).
+
+        If another request saved the game in between, change is replayed on the
+        newer game instead of overwriting it.
+        """
+        for _ in range(MAX_SAVE_ATTEMPTS):
+            manager = load_manager(store.load) # own copy, never the cached one
+            result = change(manager)
+            try:
+                save_manager(manager)
+                return manager, result
+            except ConflictError:
+                continue
+        raise ConflictError(g.user_id)
+
+    @game_bp.errorhandler(ConflictError)
+    def conflict(e):
+        return "Der Spielstand wurde gleichzeitig woanders geändert, bitte erneut versuchen.", 409
 
 
     @game_bp.route('/')
+    @conditional
     def index(username):
         manager = get_manager()
 
         # Berechne erwarteten Gewinn
-        expected_profit = sum(f.calculate_profit() for f in manager.flights)
+        expected_profit = manager.flight_totals.profit
         expected_profit -= manager.calculate_weekly_maintenance()
         expected_profit -= manager.calculate_weekly_hub_cost()
         
@@ -50,16 +154,19 @@ def return_game_blueprint():
         return render_template("dashboard.html", manager=manager, expected_profit=expected_profit, issues=issues)
 
     @game_bp.route('/hangar')
+    @conditional
     def hangar(username):
         manager = get_manager()
         return render_template("hangar.html", manager=manager)
 
     @game_bp.route('/shop')
+    @conditional
     def shop(username):
         manager = get_manager()
         return render_template("shop.html", manager=manager)
 
     @game_bp.route('/shop/view/<model_name>', methods=['POST','GET'])
+    @conditional
     def view_plane(model_name, username):
         manager = get_manager()
         model = manager.find_model(model_name)
@@ -69,67 +176,74 @@ def return_game_blueprint():
 
     @game_bp.route('/shop/buy/<model_name>', methods=['POST'])
     def buy_plane(model_name, username):
-        manager = get_manager()
         try:
-            manager.buy_plane(model_name, request.form['registration'], manager.find_city(request.form['city']))
-            save_manager(manager)
+            update_manager(lambda manager: manager.buy_plane(model_name, request.form['registration'], manager.find_city(request.form['city'])))
             return redirect(url_for('game.hangar', username=username))
         except ValueError as e:
-            return render_template("shop.html", manager=manager, error=str(e))
+            return render_template("shop.html", manager=get_manager(), error=str(e))
 
     @game_bp.route('/hangar/sell/<registration>')
     def sell_plane(registration, username):
-        manager = get_manager()
         try:
-            manager.sell_plane(registration)
-            save_manager(manager)
+            update_manager(lambda manager: manager.sell_plane(registration))
             return redirect(url_for('game.hangar', username=username))
         except ValueError as e:
-            return render_template("hangar.html", manager=manager, error=str(e))
+            return render_template("hangar.html", manager=get_manager(), error=str(e))
 
     @game_bp.route('/cities')
+    @conditional
     def cities(username):
-        manager = get_manager()
-        cities_with_hubs = [hub.city.short for hub in manager.hubs]
-        return render_template("cities.html", manager=manager, cities_with_hubs=cities_with_hubs)
+        return render_cities(get_manager())
+
+    def render_cities(manager, error=None):
+        cities_with_hubs = {hub.city.short for hub in manager.hubs}
+        args = request.args
+        hubs = {"yes": True, "no": False}.get(args.get('hubs'))
+        near = manager.find_city(args.get('near', ''))
+        results = search_cities(args.get('q', ''), cities_with_hubs, hubs,
+                                args.get('min_population', type=int), args.get('max_population', type=int),
+                                near, args.get('max_distance', type=float))
+        page = paginate(results, args.get('page', 1, type=int), CITIES_PAGE_SIZE)
+        return render_template("cities.html", manager=manager, cities_with_hubs=cities_with_hubs, page=page, total=len(results), error=error)
 
     @game_bp.route('/cities/view/<city_name>')
+    @conditional
     def view_city(city_name, username):
         manager = get_manager()
         city = manager.find_city(city_name)
         hub = manager.get_hub_in_city(city)
         if not city:
-            return render_template("cities.html", manager=manager, error="Stadt nicht gefunden.")
-        return render_template("view_city.html", manager=manager, city=city, hub=hub)
+            return render_cities(manager, error="Stadt nicht gefunden.")
+        incoming = paginate(manager.demand.ranking(city.short, incoming=True), request.args.get('in_page', 1, type=int), RANKING_PAGE_SIZE)
+        outgoing = paginate(manager.demand.ranking(city.short), request.args.get('out_page', 1, type=int), RANKING_PAGE_SIZE)
+        return render_template("view_city.html", manager=manager, city=city, hub=hub, incoming=incoming, outgoing=outgoing)
 
     @game_bp.route('/upgrade_hub/<city_short>', methods=['POST'])
     def upgrade_hub(city_short, username):
-        manager = get_manager()
-        hub = manager.get_hub_in_city(manager.find_city(city_short))
-        if not hub:
-            manager.hubs.append(Hub(manager.find_city(city_short)))
-            save_manager(manager)
-            return redirect(url_for('game.view_city', username=username, city_name=city_short))
-        hub.upgrade()
-        save_manager(manager)
+        def change(manager):
+            city = manager.find_city(city_short)
+            if city:
+                manager.upgrade_hub(city)
+        update_manager(change)
         return redirect(url_for('game.view_city', username=username, city_name=city_short))
 
     @game_bp.route('/routes/<origin>/<destination>')
+    @conditional
     def view_route(origin, destination, username):
         manager = get_manager()
         origin_city = manager.find_city(origin)
         destination_city = manager.find_city(destination)
-        passenger_availability = {}
-        total_demand = get_route_demand(origin_city, destination_city, manager.week)
-        for i in range(24):
-            passenger_availability[i] = get_potential_passenger_demand(total_demand, i, 0, origin_city.timezone)
+        total_demand = manager.demand.route(origin_city, destination_city)
+        passenger_availability = dict(enumerate(passenger_demand_curve(total_demand, origin_city.timezone)))
         distance = round(origin_city.distance_to(destination_city))
         return render_template("route.html", manager=manager, passenger_availability=passenger_availability, origin=origin_city, destination=destination_city, total=total_demand, distance=distance)
 
     @game_bp.route('/calendar')
     @game_bp.route('/calendar/<day>')
+    @conditional
     def calendar(username, day='M', error = None):
         manager = get_manager()
+        error = error or request.args.get('error') # set by add_flight when the flight was refused
         
         # Gruppiere Flüge nach Tag
         flights_by_day = {}
@@ -141,8 +255,7 @@ def return_game_blueprint():
 
         for day_code in flights_by_day:
             flights_by_day[day_code].sort(key=lambda f: f.start.to_minutes())
-        day_flights = flights_by_day[day]
-        day_profit = sum(f.calculate_profit() for f in day_flights)
+        day_profit = manager.day_totals[day].profit
 
         cities_with_hubs = [hub.city.short for hub in manager.hubs]
 
@@ -152,7 +265,6 @@ def return_game_blueprint():
 
     @game_bp.route('/calendar/add', methods=['POST'])
     def add_flight(username):
-        manager = get_manager()
         try:
             origin = request.form['origin']
             destination = request.form['destination']
@@ -161,10 +273,9 @@ def return_game_blueprint():
             hour = int(request.form['hour'])
             minute = int(request.form['minute'])
             max_passengers = int(request.form['passengers'])
-            start = Instant(day, hour, minute)
+            start = Instant(day, hour, minute) # ValueError for times outside the day, shown on the calendar
             
-            manager.create_flight(origin, destination, plane, start, max_passengers)
-            save_manager(manager)
+            update_manager(lambda manager: manager.create_flight(origin, destination, plane, start, max_passengers))
             
             return redirect(url_for('game.calendar', username=username, day=day))
         except Exception as e:
@@ -173,31 +284,47 @@ def return_game_blueprint():
 
     @game_bp.route('/calendar/delete', methods=['POST'])
     def delete_flight(username):
-        manager = get_manager()
         plane_reg = request.form['plane']
         start_str = request.form['start']
         day = request.form['day']
         
-        manager.delete_flight(plane_reg, start_str)
-        save_manager(manager)
+        update_manager(lambda manager: manager.delete_flight(plane_reg, start_str))
 
         return redirect(url_for('game.calendar', username=username, day=day))
 
     @game_bp.route('/advance_week', methods=['POST'])
     def advance_week(username):
         print("Advancing week...")
-        manager = get_manager()
         try:
-            result = manager.advance_week()
-            save_manager(manager)
+            manager, result = update_manager(lambda manager: manager.advance_week())
             return render_template("week_result.html", result=result, manager=manager)
         except ValueError as e:
             print("Error advancing week:", e)
             return redirect(url_for('game.index', username=username))
 
+    @game_bp.route('/simulate', methods=['POST'])
+    def simulate(username):
+        weeks = min(max(request.form.get('weeks', 1, type=int), 1), MAX_SIMULATED_WEEKS)
+        try:
+            _, series = update_manager(lambda manager: manager.simulate_weeks(weeks))
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        return jsonify(series)
+
     @game_bp.route('/reset', methods=['POST'])
     def reset(username):
-        r.delete(f"game:{g.user_id}")
+        # a new game replaces the old one instead of deleting it, so the version
+        # keeps counting up and pages cached for the old game are never reused
+        for _ in range(MAX_SAVE_ATTEMPTS):
+            manager = AirlineManager()
+            manager.version = store.read_version(g.user_id) or 0
+            try:
+                save_manager(manager)
+                break
+            except ConflictError:
+                continue
+        else:
+            raise ConflictError(g.user_id)
         return redirect(url_for('game.index', username=username))
 
     
@@ -205,6 +332,7 @@ def return_game_blueprint():
 
     @game_bp.route('/wiki')
     @game_bp.route('/wiki/<article>')
+    @conditional
     def wiki(username, article=None):
         manager = get_manager()
         print("Wiki article requested:", article)
@@ -218,7 +346,11 @@ def return_game_blueprint():
     @game_bp.route('/wiki/plane/<planename>')
     def wiki_plane(planename, username):
         try:
-            return render_template(f"wiki/planes/{planename}.html")
+            response = make_response(render_template(f"wiki/planes/{planename}.html"))
+            # catalog only, the same for every player
+            response.cache_control.public = True
+            response.cache_control.max_age = CATALOG_MAX_AGE
+            return response
         except:
             return render_template("wiki/main.html", error="Seite nicht gefunden.")
     # some important routes for static files and browsers and stuff
@@ -231,6 +363,6 @@ def return_game_blueprint():
     @game_bp.route("/static/<path:filename>")
     def static_files(filename, username):
         print("Serving static file:", filename)
-        return app.send_static_file(filename)
+        return current_app.send_static_file(filename)
 
     return game_bp
\ No newline at end of file
@@ -0,0 +1,148 @@
+# binary encoding of the game state for storage
+from typing import List, Optional
+from flask import json
+import msgspec
+
+from main import AirlineManager, Plane, Flight, Hub, Instant, build_lookup, get_city, get_model
+
+# first byte of every encoded game, bump it whenever the schemas below change
+CODEC_VERSION = 1
+
+
+class InstantState(msgspec.Struct, array_like=True):
+    day: str
+    hour: int
+    minute: int
+
+
+class PlaneState(msgspec.Struct, array_like=True):
+    model: str
+    registration: str
+    current_city: Optional[str] = None
+
+
+class FlightState(msgspec.Struct, array_like=True):
+    origin: str
+    destination: str
+    plane_registration: str
+    passengers: int
+    start: InstantState
+
+
+class HubState(msgspec.Struct, array_like=True):
+    city: str
+    level: int
+
+
+class ManagerState(msgspec.Struct, array_like=True):
+    planes: List[PlaneState]
+    flights: List[FlightState]
+    hubs: List[HubState]
+    money: float
+    week: int
+
+
+class MetaState(msgspec.Struct, array_like=True):
+    money: float
+    week: int
+
+
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder(ManagerState)
+_section_decoders = {
+    "meta": msgspec.msgpack.Decoder(MetaState),
+    "planes": msgspec.msgpack.Decoder(List[PlaneState]),
+    "hubs": msgspec.msgpack.Decoder(List[HubState]),
+    "flights": msgspec.msgpack.Decoder(List[FlightState]),
+}
+
+
+def _plane_states(manager: AirlineManager) -> List[PlaneState]:
+    return [PlaneState(p.model.name, p.registration, p.current_city.short if p.current_city else None) for p in manager.planes]
+
+
+def _flight_states(flights: List[Flight]) -> List[FlightState]:
+    return [FlightState(f.origin.short, f.destination.short, f.plane.registration, f.passengers,
+                        InstantState(f.start.day, f.start.hour, f.start.minute)) for f in flights]
+
+
+def _hub_states(manager: AirlineManager) -> List[HubState]:
+    return [HubState(h.city.short, h.level) for h in manager.hubs]
+
+
+def _restore(planes: List[PlaneState], flights: List[FlightState], hubs: List[HubState], money: float, week: int) -> AirlineManager:
+    restored_planes = []
+    for p in planes:
+        plane = Plane(get_model(p.model), p.registration)
+        if p.current_city:
+            plane.current_city = get_city(p.current_city)
+        restored_planes.append(plane)
+    planes_by_registration = build_lookup(restored_planes, lambda p: p.registration)
+
+    restored_flights = [Flight(get_city(f.origin), get_city(f.destination), planes_by_registration[f.plane_registration],
+                               Instant(f.start.day, f.start.hour, f.start.minute), f.passengers) for f in flights]
+    restored_hubs = [Hub(get_city(h.city), h.level) for h in hubs]
+
+    return AirlineManager.restore(restored_planes, restored_flights, restored_hubs, money, week)
+
+
+def _check_version(data: bytes):
+    if data[0] != CODEC_VERSION:
+        raise ValueError(f"Unbekannte Spielstand-Version {data[0]}")
+
+
+def encode_manager(manager: AirlineManager) -> bytes:
+    state = ManagerState(
+        planes=_plane_states(manager),
+        flights=_flight_states(manager.flights),
+        hubs=_hub_states(manager),
+        money=manager.money,
+        week=manager.week,
+    )
+    return bytes((CODEC_VERSION,)) + _encoder.encode(state)
+
+
+def decode_manager(data: bytes) -> AirlineManager:
+    # games saved before the codec existed are plain JSON
+    if data[:1] == b"{":
+        return AirlineManager.from_dict(json.loads(data))
+
+    _check_version(data)
+    state = _decoder.decode(memoryview(data)[1:])
+    return _restore(state.planes, state.flights, state.hubs, state.money, state.week)
+
+
+def encode_sections(manager: AirlineManager, sections) -> dict[str, bytes]:
+    """Encodes the given AirlineManager.SECTIONS, one value per storage field"""
+    fields = {}
+    flights_by_day = None
+    for section in sections:
+        if section == "meta":
+            state = MetaState(manager.money, manager.week)
+        elif section == "planes":
+            state = _plane_states(manager)
+        elif section == "hubs":
+            state = _hub_states(manager)
+        else:
+            if flights_by_day is None:
+                flights_by_day = {day: [] for day in Instant.DAYS}
+                for flight in manager.flights:
+                    flights_by_day[flight.start.day].append(flight)
+            state = _flight_states(flights_by_day[section.split(":")[1]])
+        fields[section] = bytes((CODEC_VERSION,)) + _encoder.encode(state)
+    return fields
+
+
+def decode_sections(fields: dict) -> AirlineManager:
+    """Builds a manager from the fields written by encode_sections()"""
+    sections = {}
+    for name, data in fields.items():
+        name = name.decode() if isinstance(name, bytes) else name
+        if name.split(":")[0] not in _section_decoders:
+            continue # bookkeeping of the store, e.g. the version field
+        _check_version(data)
+        sections[name] = _section_decoders[name.split(":")[0]].decode(memoryview(data)[1:])
+
+    meta = sections["meta"]
+    flights = [f for day in Instant.DAYS for f in sections.get(f"flights:{day}", [])]
+    return _restore(sections["planes"], flights, sections["hubs"], meta.money, meta.week)
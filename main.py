@@ -1,8 +1,10 @@
-import random, math
-from typing import List, Optional
+import math, threading, zlib
+from typing import List, Optional, Tuple
 from pathlib import Path
 from flask import json
 import csv
+from array import array
+from functools import lru_cache, total_ordering
 
 def load_cities() -> List['City']:
     cities = []
@@ -10,7 +12,7 @@ def load_cities() -> List['City']:
             reader = csv.reader(f)
             for row in reader:
                 if row:
-                    city = City(row[0], int(row[1]), float(row[2]), float(row[3]), row[4], float(row[5]))
+                    city = City(row[0], int(row[1]), float(row[2]), float(row[3]), row[4], float(row[5]), index=len(cities))
                     cities.append(city)
     return cities
 
@@ -23,20 +25,97 @@ def load_models() -> List['PlaneModel']:
             models.append(PlaneModel.from_dict(data))
     return models
 
+EARTH_RADIUS_KM = 6371.0
 
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1 = math.radians(lat1)
+    lon1 = math.radians(lon1)
+    lat2 = math.radians(lat2)
+    lon2 = math.radians(lon2)
 
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = math.sin(dlat / 2)**2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2)**2
+
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    return EARTH_RADIUS_KM * c
+
+def build_distance_matrix(cities: List['City']) -> List[List[float]]:
+    """Great-circle distances between all cities, indexed by City.index"""
+    lats = [math.radians(c.x) for c in cities]
+    lons = [math.radians(c.y) for c in cities]
+    cos_lats = [math.cos(lat) for lat in lats]
+    points = list(zip(lats, lons, cos_lats))
+
+    matrix = []
+    for lat1, lon1, cos1 in points:
+        # same formula as haversine(), evaluated for a whole row at once
+        row = [math.sin((lat2 - lat1) / 2)**2 + cos1 * cos2 * math.sin((lon2 - lon1) / 2)**2
+               for lat2, lon2, cos2 in points]
+        matrix.append([EARTH_RADIUS_KM * (2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))) for a in row])
+    return matrix
+
+
+@total_ordering
 class Instant:
+    """A point in the game week, stored as minutes since Monday 00:00"""
     DAYS = {'M': 'Monday', 'T': 'Tuesday', 'W': 'Wednesday', 
             'H': 'Thursday', 'F': 'Friday', 'S': 'Saturday', 'U': 'Sunday'}
     DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+    DAY_CODES = list(DAYS.keys())
+    DAY_INDEX = {day: i for i, day in enumerate(DAYS)}
+    MINUTES_PER_DAY = 24 * 60
+    MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+    __slots__ = ("_minutes",)
     
     def __init__(self, day: str, hour: int, minute: int):
-        self.day = day
-        self.hour = hour
-        self.minute = minute
+        # out of range values would silently land on another day
+        if day not in self.DAY_INDEX:
+            raise ValueError(f"Ungültiger Tag '{day}'")
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f"Ungültige Uhrzeit {hour}:{minute:02d}")
+        self._minutes = self.DAY_INDEX[day] * self.MINUTES_PER_DAY + hour * 60 + minute
+
+    @classmethod
+    def from_minutes(cls, minutes: int) -> 'Instant':
+        instant = cls.__new__(cls)
+        instant._minutes = minutes
+        return instant
+
+    @property
+    def day(self) -> str:
+        return self.DAY_CODES[self._minutes // self.MINUTES_PER_DAY]
+
+    @property
+    def hour(self) -> int:
+        return self._minutes % self.MINUTES_PER_DAY // 60
+
+    @property
+    def minute(self) -> int:
+        return self._minutes % 60
     
     def __str__(self):
         return f"{self.day}-{self.hour}-{self.minute}"
+
+    def __repr__(self):
+        return f"Instant({self.day!r}, {self.hour}, {self.minute})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Instant):
+            return NotImplemented
+        return self._minutes == other._minutes
+
+    def __lt__(self, other):
+        if not isinstance(other, Instant):
+            return NotImplemented
+        return self._minutes < other._minutes
+
+    def __hash__(self):
+        return hash(self._minutes)
     
     def to_dict(self):
         return {'day': self.day, 'hour': self.hour, 'minute': self.minute}
@@ -51,29 +130,26 @@ class Instant:
         return cls(parts[0], int(parts[1]), int(parts[2]))
     
     def to_minutes(self) -> int:
-        day_index = list(self.DAYS.keys()).index(self.day)
-        return day_index * 24 * 60 + self.hour * 60 + self.minute
+        return self._minutes
     
     def add_minutes(self, minutes: int):
-        total_minutes = self.to_minutes() + minutes
-        day_index = (total_minutes // (24 * 60)) % 7
-        remaining = total_minutes % (24 * 60)
-        hour = remaining // 60
-        minute = remaining % 60
-        return Instant(list(self.DAYS.keys())[day_index], hour, minute)
+        return Instant.from_minutes((self._minutes + minutes) % self.MINUTES_PER_WEEK)
     
     def format_time(self):
         return f"{self.hour:02d}:{self.minute:02d}"
 
 
 class City:
-    def __init__(self, name: str, population: int, x: int, y: int, short: str, timezone: float):
+    __slots__ = ("name", "population", "x", "y", "short", "timezone", "index")
+
+    def __init__(self, name: str, population: int, x: int, y: int, short: str, timezone: float, index: Optional[int] = None):
         self.name = name
         self.population = population
         self.x = x
         self.y = y
         self.short = short
         self.timezone = timezone
+        self.index = index # position in the catalog, None for cities outside of it
     
     def to_dict(self):
         return {
@@ -90,22 +166,9 @@ class City:
         return cls(data['name'], data['population'], data['x'], data['y'], data['short'], data['timezone'])
     
     def distance_to(self, other: 'City') -> float:
-        EARTH_RADIUS_KM = 6371.0
-
-        lat1 = math.radians(self.x)
-        lon1 = math.radians(self.y)
-        lat2 = math.radians(other.x)
-        lon2 = math.radians(other.y)
-
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-
-        a = math.sin(dlat / 2)**2 + \
-            math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2)**2
-
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-        return EARTH_RADIUS_KM * c
+        if self.index is not None and other.index is not None:
+            return GAME_WORLD["distances"][self.index][other.index]
+        return haversine(self.x, self.y, other.x, other.y)
 
 class Hub:
     LEVEL = {
@@ -150,6 +213,8 @@ class Hub:
             "weekly_cost": 50000
         }
     }
+    __slots__ = ("city", "level", "passenger_bonus", "name", "weekly_cost")
+
     def __init__(self, city: City, level: int = 1):
         self.city = city
         self.level = level
@@ -163,11 +228,7 @@ class Hub:
 
     @classmethod
     def from_dict(cls, data: dict):
-        cities = get_cities()
-        city_short = data['city']
-        city = next((c for c in cities if c.short == city_short), None)
-
-        return cls(city, int(data['level']))
+        return cls(get_city(data['city']), int(data['level']))
 
     def to_dict(self):
         return {
@@ -177,6 +238,8 @@ class Hub:
 
 
 class PlaneModel:
+    __slots__ = ("name", "capacity", "range", "velocity", "price", "maintenance", "pilots")
+
     def __init__(self, name: str, capacity: int, range: int, velocity: int, price: int, maintenance: int, pilots: int):
         self.name = name
         self.capacity = capacity
@@ -203,16 +266,35 @@ class PlaneModel:
 
 
 class Plane:
+    __slots__ = ("model", "registration", "current_city", "flights")
+
     def __init__(self, model: PlaneModel, registration: str):
         self.model = model
         self.registration = registration
-        self.capacity = model.capacity
-        self.range = model.range
-        self.velocity = model.velocity
         self.current_city: Optional[City] = None
         self.flights: List['Flight'] = []
-        self.maintenance = model.maintenance
-        self.pilots = model.pilots
+
+    # specs come from the model, planes only hold what differs between them
+
+    @property
+    def capacity(self) -> int:
+        return self.model.capacity
+
+    @property
+    def range(self) -> int:
+        return self.model.range
+
+    @property
+    def velocity(self) -> int:
+        return self.model.velocity
+
+    @property
+    def maintenance(self) -> int:
+        return self.model.maintenance
+
+    @property
+    def pilots(self) -> int:
+        return self.model.pilots
 
     def to_dict(self):
         return {
@@ -223,14 +305,9 @@ class Plane:
 
     @classmethod
     def from_dict(cls, data):
-        models = get_models()
-        model = next((m for m in models if m.name == data['model']), None)
-
-        plane = cls(model, data['registration'])
-        cities = get_cities()
+        plane = cls(get_model(data['model']), data['registration'])
         if data['current_city']:
-            city_short = data['current_city']
-            plane.current_city = next((c for c in cities if c.short == city_short), None)
+            plane.current_city = get_city(data['current_city'])
 
         return plane
     
@@ -245,16 +322,38 @@ class Plane:
 class Flight:
     FUELCOST_PER_KM = 0.08
     PILOT_SALARY_PER_MINUTE = 0.67 # make this dependent of flight duration
+
+    __slots__ = ("origin", "destination", "plane", "_passengers", "distance", "duration", "start", "end",
+                 "revenue", "variable_cost", "fixed_cost", "profit")
     
     def __init__(self, origin: City, destination: City, plane: Plane, start: Instant, passengers: int):
         self.origin = origin
         self.destination = destination
         self.plane = plane
-        self.passengers = passengers
         self.distance = origin.distance_to(destination)
         self.duration = round(self.distance / plane.velocity)
         self.start = start
         self.end = start.add_minutes(self.duration)
+        self.variable_cost = self.distance * self.FUELCOST_PER_KM # make this model dependent
+        self.fixed_cost = self.plane.maintenance + self.plane.pilots*self.PILOT_SALARY_PER_MINUTE*self.duration
+        self.passengers = passengers
+
+    @property
+    def passengers(self) -> int:
+        return self._passengers
+
+    @passengers.setter
+    def passengers(self, passengers: int):
+        # revenue and profit are cached, they only change with the passengers
+        self._passengers = passengers
+        if self.distance < 500:
+            ticket_price = 0.25
+        elif self.distance < 1000:
+            ticket_price = 0.2
+        else:
+            ticket_price = 0.15
+        self.revenue = passengers * ticket_price * self.distance
+        self.profit = self.revenue - self.variable_cost - self.fixed_cost
     
     def to_dict(self):
         return {
@@ -266,38 +365,146 @@ class Flight:
         }
     
     @classmethod
-    def from_dict(cls, data, planes):
-        cities = get_cities()
-        origin = next(c for c in cities if c.short == data['origin'])
-        dest = next(c for c in cities if c.short == data['destination'])
-        plane = next(p for p in planes if p.registration == data['plane_registration'])
+    def from_dict(cls, data, planes: dict[str, 'Plane']):
+        origin = get_city(data['origin'])
+        dest = get_city(data['destination'])
+        plane = planes[data['plane_registration']]
         start = Instant.from_dict(data['start'])
         return cls(origin, dest, plane, start, data['passengers'])
     
     def calculate_revenue(self) -> float:
-        if self.distance < 500:
-            ticket_price = 0.25
-        elif self.distance < 1000:
-            ticket_price = 0.2
-        else:
-            ticket_price = 0.15
-        return self.passengers * ticket_price * self.distance
+        return self.revenue
 
     def calculate_variable_cost(self) -> float:
-        return self.distance * self.FUELCOST_PER_KM # make this model dependent
+        return self.variable_cost
 
     def calculate_fixed_cost(self) -> float:
-        return self.plane.maintenance + self.plane.pilots*self.PILOT_SALARY_PER_MINUTE*self.duration
+        return self.fixed_cost
 
     def calculate_profit(self) -> float:
-        return self.calculate_revenue() - self.calculate_variable_cost() - self.calculate_fixed_cost()
+        return self.profit
+
+
+class RouteUsage:
+    """Passengers already booked on one route, in total and per start minute of the week"""
+    __slots__ = ("total", "by_start")
+
+    def __init__(self):
+        self.total = 0
+        self.by_start: dict[int, int] = {}
+
+    def add(self, flight: Flight):
+        start = flight.start.to_minutes()
+        self.total += flight.passengers
+        self.by_start[start] = self.by_start.get(start, 0) + flight.passengers
+
+    def remove(self, flight: Flight):
+        start = flight.start.to_minutes()
+        self.total -= flight.passengers
+        self.by_start[start] -= flight.passengers
+
+
+class FlightTotals:
+    """Running revenue, cost and profit of a group of flights"""
+    __slots__ = ("flights", "revenue", "cost", "profit")
+
+    def __init__(self):
+        self.flights = 0
+        self.revenue = 0.0
+        self.cost = 0.0
+        self.profit = 0.0
+
+    def add(self, flight: Flight):
+        self.flights += 1
+        self.revenue += flight.revenue
+        self.cost += flight.variable_cost + flight.fixed_cost
+        self.profit += flight.profit
+
+    def remove(self, flight: Flight):
+        self.flights -= 1
+        if self.flights == 0:
+            self.__init__() # no float residue once the group is empty
+            return
+        self.revenue -= flight.revenue
+        self.cost -= flight.variable_cost + flight.fixed_cost
+        self.profit -= flight.profit
+
+
+class WeekSettlement:
+    """The flights of a week held as columns, settled in bulk.
+
+    Every per-flight value is computed with the same formulas as Flight. The
+    totals match settling flight by flight up to float rounding: sum()
+    compensates rounding errors from Python 3.12 on, a += loop does not.
+    """
+    def __init__(self, flights: List[Flight]):
+        self.planes = [f.plane for f in flights]
+        self.distance = [f.distance for f in flights]
+        self.passengers = [f.passengers for f in flights]
+        self.duration = [f.duration for f in flights]
+        self.maintenance = [f.plane.maintenance for f in flights]
+        self.pilots = [f.plane.pilots for f in flights]
+        self.destination = [f.destination.index for f in flights]
+
+        self.ticket_price = [0.25 if d < 500 else 0.2 if d < 1000 else 0.15 for d in self.distance]
+        self.revenue = [p * t * d for p, t, d in zip(self.passengers, self.ticket_price, self.distance)]
+        self.fuel = [d * Flight.FUELCOST_PER_KM for d in self.distance]
+        self.crew = [p * Flight.PILOT_SALARY_PER_MINUTE * t for p, t in zip(self.pilots, self.duration)]
+        self.cost = [(m + c) + f for m, c, f in zip(self.maintenance, self.crew, self.fuel)]
+
+    def __len__(self) -> int:
+        return len(self.distance)
+
+    def rebook(self, flights: List[Flight]):
+        """Takes the new passengers of the same flights, the other columns do not change"""
+        self.passengers = [f.passengers for f in flights]
+        self.revenue = [p * t * d for p, t, d in zip(self.passengers, self.ticket_price, self.distance)]
+
+    def total_revenue(self) -> float:
+        return sum(self.revenue)
+
+    def total_cost(self) -> float:
+        """Fuel, crew and per-flight maintenance"""
+        return sum(self.cost)
+
+    def total_fuel(self) -> float:
+        return sum(self.fuel)
+
+    def total_crew(self) -> float:
+        return sum(self.crew)
+
+    def total_maintenance(self) -> float:
+        return sum(self.maintenance)
+
+    def final_positions(self) -> dict[Plane, City]:
+        """Where each plane ends up, the destination of its last flight in the schedule"""
+        cities = get_cities()
+        return {plane: cities[destination] for plane, destination in zip(self.planes, self.destination)}
 
 
 # ==================== GAME MANAGER ====================
-GAME_WORLD = {
-    "cities": load_cities(),
-    "models": [PlaneModel("Dash 8 Q200", 39, 2000, 3, 50000, 200, 2)] + load_models()
-}
+def build_lookup(items, *keys) -> dict:
+    """Maps every key of every item to the first item that has it, like a linear search would"""
+    lookup = {}
+    for item in items:
+        for key in keys:
+            lookup.setdefault(key(item), item)
+    return lookup
+
+class GameWorld(dict):
+    """Cities, plane models and route tables, loaded on first access (see world.py)"""
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def __missing__(self, key):
+        with self._lock:
+            if not self:
+                from world import load_world # world.py builds on this module
+                self.update(load_world())
+        return dict.__getitem__(self, key)
+
+GAME_WORLD = GameWorld()
 
 def get_cities() -> List[City]:
     if GAME_WORLD is not None:
@@ -313,22 +520,32 @@ def get_models() -> List[PlaneModel]:
     GAME_WORLD["models"] = [PlaneModel("Dash 8 Q200", 39, 2000, 3, 50000, 200)] + load_models()
     return GAME_WORLD["models"]
 
+def get_city(short: str) -> Optional[City]:
+    return GAME_WORLD["cities_by_short"].get(short)
+
+def get_model(name: str) -> Optional[PlaneModel]:
+    return GAME_WORLD["models_by_name"].get(name)
+
 class AirlineManager:
+    # independently stored parts of a game, see mark_dirty()
+    SECTIONS = ("meta", "planes", "hubs") + tuple(f"flights:{day}" for day in Instant.DAYS)
+
     def __init__(self):
         self.cities: List[City] = []
         self.planes: List[Plane] = []
         self.flights: List[Flight] = []
         self.hubs: List[Hub] = []
-        self.demand: dict[str, dict[str, int]] = {}
+        self._demand: Optional['DemandMatrix'] = None
         self.money: float = 50000000.0
         self.week: int = 1
         self.plane_counter: int = 1
         self.available_models: List[PlaneModel] = []
+        self.dirty: set[str] = set(self.SECTIONS)
+        self.version: int = 0 # stored version this game was loaded at, see storage.GameStore
         self._initialize_game()
     
     def _initialize_game(self):
         self.cities = get_cities()
-        self.update_demand()
         self.available_models = get_models()
 
         starter_plane = Plane(self.available_models[0], f"Starter")
@@ -337,6 +554,36 @@ class AirlineManager:
         self.planes.append(starter_plane)
         self.plane_counter += 1
         self.hubs = [Hub(starter_plane.current_city)] + [Hub(city) for city in self.cities[1:11]]
+        self._build_indexes()
+
+    def _build_indexes(self):
+        self._planes_by_registration = build_lookup(self.planes, lambda p: p.registration.lower())
+        self._hubs_by_city = build_lookup(self.hubs, lambda h: h.city.short if h.city else None)
+        self._reset_flight_indexes()
+        for flight in self.flights:
+            self._track_flight(flight)
+
+    def _reset_flight_indexes(self):
+        self._route_usage: dict[tuple[str, str], RouteUsage] = {}
+        self.flight_totals = FlightTotals()
+        self.day_totals = {day: FlightTotals() for day in Instant.DAYS}
+
+    def _track_flight(self, flight: Flight):
+        self._route_usage_for(flight).add(flight)
+        self.flight_totals.add(flight)
+        self.day_totals[flight.start.day].add(flight)
+
+    def _untrack_flight(self, flight: Flight):
+        self._route_usage_for(flight).remove(flight)
+        self.flight_totals.remove(flight)
+        self.day_totals[flight.start.day].remove(flight)
+
+    def _route_usage_for(self, flight: Flight) -> RouteUsage:
+        key = (flight.origin.short, flight.destination.short)
+        usage = self._route_usage.get(key)
+        if usage is None:
+            usage = self._route_usage[key] = RouteUsage()
+        return usage
 
     def to_dict(self):
         return {
@@ -349,47 +596,62 @@ class AirlineManager:
     
     @classmethod
     def from_dict(cls, data):
+        planes = [Plane.from_dict(p) for p in data['planes']]
+        planes_by_registration = build_lookup(planes, lambda p: p.registration)
+        flights = [Flight.from_dict(f, planes_by_registration) for f in data['flights']]
+        hubs = [Hub.from_dict(h) for h in data['hubs']]
+        return cls.restore(planes, flights, hubs, data['money'], data['week'])
+
+    @classmethod
+    def restore(cls, planes: List[Plane], flights: List[Flight], hubs: List[Hub], money: float, week: int) -> 'AirlineManager':
+        """Builds a manager around already deserialized game objects"""
         manager = cls.__new__(cls)
         manager.cities = get_cities()
         manager.available_models = get_models()
-        manager.planes = [Plane.from_dict(p) for p in data['planes']]
-        manager.flights = [Flight.from_dict(f, manager.planes) for f in data['flights']]
-        manager.hubs = [Hub.from_dict(h) for h in data['hubs']]
+        manager.planes = planes
+        manager.flights = flights
+        manager.hubs = hubs
 
         for plane in manager.planes:
-            plane.flights = [f for f in manager.flights if f.plane.registration == plane.registration]
+            plane.flights = []
+        for flight in manager.flights:
+            flight.plane.flights.append(flight)
+        manager._build_indexes()
         
-        manager.money = data['money']
-        manager.week = data['week']
+        manager.money = money
+        manager.week = week
         manager.plane_counter = len(manager.planes)
-        manager.demand = {}
-        manager.update_demand()
+        manager._demand = None # fetched on first access, most pages never read it
+        manager.dirty = set()
+        manager.version = 0
         return manager
+
+    @property
+    def demand(self) -> 'DemandMatrix':
+        if self._demand is None or self._demand.week != self.week:
+            self._demand = get_week_demand(self.week)
+        return self._demand
     
+    def mark_dirty(self, *sections: str):
+        """Remembers which sections changed, so only those have to be saved"""
+        self.dirty.update(sections)
+
+    def mark_all_dirty(self):
+        self.dirty.update(self.SECTIONS)
+
     def find_city(self, name: str) -> Optional[City]:
-        for city in self.cities:
-            if city.name.lower() == name.lower() or city.short.lower() == name.lower():
-                return city
-        return None
+        return GAME_WORLD["city_lookup"].get(name.lower())
     
     def find_plane(self, registration: str) -> Optional[Plane]:
-        for plane in self.planes:
-            if plane.registration.lower() == registration.lower():
-                return plane
-        return None
+        return self._planes_by_registration.get(registration.lower())
 
     def find_model(self, name: str) -> Optional[PlaneModel]:
-        print(self.available_models)
-        for model in self.available_models:
-            if model.name.lower() == name.lower():
-                return model
-        return None
+        return GAME_WORLD["model_lookup"].get(name.lower())
     
     def get_hub_in_city(self, city: City) -> Optional[Hub]:
-        for hub in self.hubs:
-            if hub.city == city:
-                return hub
-        return None
+        if city is None:
+            return None
+        return self._hubs_by_city.get(city.short)
 
     def buy_plane(self, model_name: str, registration: str, city: City) -> Plane:
         model = self.find_model(model_name)
@@ -398,6 +660,8 @@ class AirlineManager:
 
         if self.money < model.price:
             raise ValueError(f"Nicht genug Geld!")
+        if self.find_plane(registration):
+            raise ValueError(f"Registrierung '{registration}' ist bereits vergeben")
         
         self.money -= model.price
         self.plane_counter += 1
@@ -405,6 +669,8 @@ class AirlineManager:
         plane = Plane(model, registration)
         plane.current_city = city
         self.planes.append(plane)
+        self._planes_by_registration[registration.lower()] = plane
+        self.mark_dirty("meta", "planes")
         
         return plane
     
@@ -413,23 +679,37 @@ class AirlineManager:
         if not plane:
             raise ValueError(f"Flugzeug mit Registrierung '{registration}' nicht gefunden")
         
-        if any(f for f in self.flights if f.plane == plane):
+        if plane.flights:
             raise ValueError(f"Flugzeug '{registration}' hat noch geplante Flüge und kann nicht verkauft werden")
         
         sell_price = plane.sell()
         self.money += sell_price
         self.planes.remove(plane)
+        del self._planes_by_registration[registration.lower()]
+        self.mark_dirty("meta", "planes")
         
         return sell_price
 
+    def upgrade_hub(self, city: City) -> Hub:
+        """Baut einen Hub in der Stadt oder erweitert den bestehenden"""
+        hub = self.get_hub_in_city(city)
+        if hub is None:
+            hub = Hub(city)
+            self.hubs.append(hub)
+            self._hubs_by_city[city.short] = hub
+        else:
+            hub.upgrade()
+        self.mark_dirty("hubs")
+        return hub
+
     def create_flight(self, origin_name: str, dest_name: str, plane_reg: str, start: Instant, max_passengers: int) -> Flight:
         origin = self.find_city(origin_name)
         destination = self.find_city(dest_name)
         plane = self.find_plane(plane_reg)
-        distance = origin.distance_to(destination)
 
         if not origin or not destination or not plane:
             raise ValueError("Stadt oder Flugzeug nicht gefunden")
+        distance = origin.distance_to(destination)
         if max_passengers > plane.capacity:
             raise ValueError(f"Zu viele Passagiere! Max: {plane.capacity}")
         if not plane.can_fly(distance):
@@ -444,11 +724,12 @@ class AirlineManager:
         # Problem with boost due to no recalculation of older flights before building hub also make function for recalculating all flights when a week passes
         # also some problem with the "there will always be someone flying" part when there are too many flights on the route
 
-        pot_passengers = get_potential_passenger_demand(get_route_demand(origin, destination, self.week), start.hour, start.minute, origin.timezone)* origin_hub.passenger_bonus
+        route_demand = self.demand.route(origin, destination)
+        pot_passengers = get_potential_passenger_demand(route_demand, start.hour, start.minute, origin.timezone)* origin_hub.passenger_bonus
         currently_flewn_passengers_in_time = self.check_route_usage(origin.short, destination.short, start)
         currently_flewn_passengers = self.check_route_usage(origin.short, destination.short, None)
         available_demand = round((pot_passengers - currently_flewn_passengers_in_time) * 0.8) # 80% because always someone flys
-        weekly_max = round(get_route_demand(origin, destination, self.week) - currently_flewn_passengers)
+        weekly_max = round(route_demand - currently_flewn_passengers)
         passengers = min(max_passengers, available_demand, weekly_max)
 
 
@@ -456,6 +737,8 @@ class AirlineManager:
         flight = Flight(origin, destination, plane, start, passengers)
         self.flights.append(flight)
         plane.flights.append(flight)
+        self._track_flight(flight)
+        self.mark_dirty(f"flights:{start.day}")
         
         return flight
     
@@ -466,9 +749,10 @@ class AirlineManager:
                 str(flight.start) == start_str):
                 # Entferne von globaler Liste
                 self.flights.pop(i)
-                # Entferne von Flugzeug
-                flight.plane.flights = [f for f in flight.plane.flights 
-                                       if not (str(f.start) == start_str)]
+                # Entferne von Flugzeug, nur genau diesen Flug
+                flight.plane.flights.remove(flight)
+                self._untrack_flight(flight)
+                self.mark_dirty(f"flights:{flight.start.day}")
                 return True
         return False
     
@@ -497,24 +781,15 @@ class AirlineManager:
 
     def check_route_usage(self, origin: str, destination: str, time: Instant) -> int:
         """Überprüft die Nutzung der Routen"""
-        route_usage = 0
-        for flight in self.flights:
-            if flight.origin.short == origin and flight.destination.short == destination:
-                if time is not None:
-                    if flight.start.to_minutes() == time.to_minutes():
-                        route_usage += flight.passengers
-                else:
-                    route_usage += flight.passengers
-
-        return route_usage
+        usage = self._route_usage.get((origin, destination))
+        if usage is None:
+            return 0
+        if time is None:
+            return usage.total
+        return usage.by_start.get(time.to_minutes(), 0)
 
     def update_demand(self):
-        if self.demand != {}:
-            self.demand.clear()
-        for i in self.cities:
-            self.demand[i.short] = {}
-            for j in self.cities:
-                self.demand[i.short][j.short] = get_route_demand(i, j, self.week)
+        self._demand = get_week_demand(self.week)
 
     def flights_for_plane(self, plane):
         return [f for f in self.flights if f.plane == plane]
@@ -531,10 +806,15 @@ class AirlineManager:
             hub_weekly_cost += hub.weekly_cost
         return hub_weekly_cost
     
-    def recalculate_flights(self): #! TODO
-        for flight in self.flights:
+    def recalculate_flights(self):
+        """Bucht alle Flüge neu, z.B. mit der Nachfrage einer neuen Woche"""
+        flights = self.flights
+        self.flights = []
+        self._reset_flight_indexes()
+        for plane in self.planes:
+            plane.flights = []
+        for flight in flights:
             self.create_flight(flight.origin.short, flight.destination.short, flight.plane.registration, flight.start, flight.passengers)
-            self.flights.remove(flight)
 
     def advance_week(self) -> dict:
         print("Checkpint C")
@@ -542,14 +822,13 @@ class AirlineManager:
         if issues:
             raise ValueError("Flugplan ungültig!")
 
-        total_revenue = 0
-        total_cost = 0
-        flight_count = len(self.flights)
-        
-        for flight in self.flights:
-            total_revenue += flight.calculate_revenue()
-            total_cost += flight.calculate_fixed_cost() + flight.calculate_variable_cost()
-            flight.plane.current_city = flight.destination
+        settlement = WeekSettlement(self.flights)
+        total_revenue = settlement.total_revenue()
+        total_cost = settlement.total_cost()
+        flight_count = len(settlement)
+
+        for plane, city in settlement.final_positions().items():
+            plane.current_city = city
 
         maintenance = self.calculate_weekly_maintenance()
         hub_weekly_cost = self.calculate_weekly_hub_cost()
@@ -561,6 +840,7 @@ class AirlineManager:
         
         self.money += total_profit
         self.week += 1
+        self.mark_all_dirty()
         
         # Lösche Flüge
 
@@ -585,15 +865,109 @@ class AirlineManager:
             'new_balance': self.money
         }
 
+    def simulate_weeks(self, weeks: int) -> dict[str, list]:
+        """Spielt mehrere Wochen am Stück.
+
+        Returns the advance_week() results as one list per key. Stops early, after
+        the last valid week, if the flight plan becomes invalid on the way.
+        """
+        series: dict[str, list] = {}
+        if weeks < 1:
+            return series
+        if self.check_flight_plan():
+            raise ValueError("Flugplan ungültig!")
+
+        # the flights stay the same from week to week, only their passengers are rebooked,
+        # so the settlement columns, the route usage index and the bookings are built once
+        settlement = WeekSettlement(self.flights)
+        positions = settlement.final_positions()
+        bookings = self._bookings()
+        maintenance = self.calculate_weekly_maintenance()
+        hub_weekly_cost = self.calculate_weekly_hub_cost()
+        # from the second week on every plane starts where its last flight landed
+        repeatable = all(positions[plane] == min(plane.flights, key=lambda f: f.start.to_minutes()).origin
+                         for plane in positions)
+
+        for n in range(weeks):
+            if n == 1 and not repeatable:
+                break
+            total_revenue = settlement.total_revenue()
+            total_cost = settlement.total_cost()
+            total_cost += maintenance
+            total_cost += hub_weekly_cost
+            total_profit = total_revenue - total_cost
+
+            for plane, city in positions.items():
+                plane.current_city = city
+            self.money += total_profit
+            self.week += 1
+            self.update_demand()
+            self._rebook_flights(bookings)
+            settlement.rebook(self.flights)
+
+            result = {
+                'week': self.week - 1,
+                'flights': len(settlement),
+                'revenue': total_revenue,
+                'cost': total_cost - maintenance,
+                'maintenance': maintenance,
+                'profit': total_profit,
+                'new_balance': self.money
+            }
+            for key, value in result.items():
+                series.setdefault(key, []).append(value)
+        self.mark_all_dirty()
+        return series
+
+    def _bookings(self) -> List[tuple]:
+        """What booking each flight needs besides the week's demand, in schedule order.
+
+        The same as create_flight() reads, hubs and flights do not change while weeks are simulated.
+        """
+        n = len(self.cities)
+        bookings = []
+        for flight in self.flights:
+            start = flight.start
+            factor = time_of_day_factors(flight.origin.timezone)[start.hour * 60 + start.minute]
+            bonus = self.get_hub_in_city(flight.origin).passenger_bonus
+            route = self.demand.positions[flight.origin.short] * n + self.demand.positions[flight.destination.short]
+            bookings.append((flight, self._route_usage_for(flight), start.to_minutes(), route, factor, bonus))
+        return bookings
+
+    def _rebook_flights(self, bookings: List[tuple]):
+        """recalculate_flights() without rebuilding anything: the flights keep their place
+        in the schedule and the route usage index, only passengers and totals are recounted"""
+        for usage in self._route_usage.values():
+            usage.total = 0
+            usage.by_start.clear()
+        self.flight_totals = FlightTotals()
+        self.day_totals = {day: FlightTotals() for day in Instant.DAYS}
+
+        values = self.demand.values
+        for flight, usage, start, route, factor, bonus in bookings:
+            route_demand = values[route]
+            pot_passengers = round(route_demand * factor + 0.2) * bonus
+            available_demand = round((pot_passengers - usage.by_start.get(start, 0)) * 0.8)
+            weekly_max = round(route_demand - usage.total)
+            flight.passengers = min(flight.passengers, available_demand, weekly_max)
+            usage.add(flight)
+            self.flight_totals.add(flight)
+            self.day_totals[flight.start.day].add(flight)
+
 
 def get_route_demand(origin: City, destination: City, week: int) -> int | None:
     if origin == destination:
         return None
 
-    o = origin.population
-    p = destination.population
-
     d = origin.distance_to(destination)
+    demand = base_route_demand(origin.population, destination.population, d)
+    demand *= route_noise(origin, destination, week)
+
+    return round(max(demand, 0))
+
+
+def base_route_demand(o: int, p: int, d: float) -> float:
+    """Week-independent part of the demand between two cities with populations o and p, d km apart"""
     d = max(d, 1)
 
     peak = 3000      # km where demand is strongest
@@ -610,27 +984,199 @@ def get_route_demand(origin: City, destination: City, week: int) -> int | None:
         hub_bonus = math.log10(o * p) / 10
         demand *= (1 + hub_bonus)
 
-    random.seed(hash(origin.name + destination.name + str(week)))
-    demand *= random.uniform(0.09, 0.11)
+    return demand
+
+
+def route_noise(origin: City, destination: City, week: int) -> float:
+    """Weekly fluctuation of a route's demand"""
+    return route_noise_row(origin, [destination], week)[0]
+
+
+def route_noise_row(origin: City, destinations: List[City], week: int) -> List[float]:
+    """Weekly fluctuation of the routes from origin to each destination.
+
+    Counter-based: every value is a pure function of (origin, destination, week),
+    so it is the same in every process and can be computed in any order.
+    """
+    origin_key = zlib.crc32(origin.short.encode()) << 32
+    return [0.09 + 0.02 * (_mix64(_mix64(origin_key | zlib.crc32(destination.short.encode())) ^ week) >> 11) * 2.0**-53
+            for destination in destinations]
 
-    return round(max(demand, 0))
+
+_MASK64 = (1 << 64) - 1
+
+def _mix64(x: int) -> int:
+    """splitmix64 finalizer, scrambles a 64 bit counter into a uniformly distributed value"""
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+class DemandRow:
+    """Demand from one origin to every city, readable like a dict keyed by short code"""
+    def __init__(self, matrix: 'DemandMatrix', origin: int):
+        self.matrix = matrix
+        self.origin = origin
+
+    def __getitem__(self, short: str) -> Optional[int]:
+        return self.matrix.value(self.origin, self.matrix.positions[short])
+
+    def get(self, short: str, default=None) -> Optional[int]:
+        position = self.matrix.positions.get(short)
+        if position is None:
+            return default
+        return self.matrix.value(self.origin, position)
+
+    def __contains__(self, short: str) -> bool:
+        return short in self.matrix.positions
+
+    def __iter__(self):
+        return iter(self.matrix.positions)
+
+    def __len__(self) -> int:
+        return len(self.matrix.positions)
+
+    def keys(self):
+        return self.matrix.positions.keys()
+
+    def items(self):
+        return ((short, self[short]) for short in self.matrix.positions)
+
+
+class DemandMatrix:
+    """Demand of every route for one week, stored as a flat origin x destination array.
+
+    Reads like the old dict of dicts: matrix[origin_short][destination_short].
+    Routes from a city to itself have no demand and read as None.
+    """
+    NO_DEMAND = -1
+
+    def __init__(self, cities: List[City], week: int, values: array):
+        self.cities = cities
+        self.week = week
+        self.values = values
+        self.positions = {city.short: i for i, city in enumerate(cities)}
+        self._rankings: dict[tuple[str, bool], List[Tuple[City, Optional[int]]]] = {}
+
+    def value(self, origin: int, destination: int) -> Optional[int]:
+        demand = self.values[origin * len(self.cities) + destination]
+        return None if demand == self.NO_DEMAND else demand
+
+    def route(self, origin: City, destination: City) -> Optional[int]:
+        return self.value(self.positions[origin.short], self.positions[destination.short])
+
+    def ranking(self, short: str, incoming: bool = False) -> List[Tuple[City, Optional[int]]]:
+        """(city, demand) of every other city from short, or to it with incoming, highest demand first.
+
+        Cities with the same demand keep their catalog order. Computed once per
+        city and direction, like the matrix itself it must not be modified.
+        """
+        key = (short, incoming)
+        ranking = self._rankings.get(key)
+        if ranking is None:
+            position = self.positions[short]
+            if incoming:
+                pairs = [(other, self.value(self.positions[other.short], position)) for other in self.cities if other.short != short]
+            else:
+                pairs = [(other, self.value(position, self.positions[other.short])) for other in self.cities if other.short != short]
+            ranking = self._rankings[key] = sorted(pairs, key=lambda pair: pair[1], reverse=True)
+        return ranking
+
+    def __getitem__(self, short: str) -> DemandRow:
+        return DemandRow(self, self.positions[short])
+
+    def get(self, short: str, default=None):
+        if short not in self.positions:
+            return default
+        return self[short]
+
+    def __contains__(self, short: str) -> bool:
+        return short in self.positions
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def keys(self):
+        return self.positions.keys()
+
+
+def build_base_demand(cities: List[City], distances: List[List[float]]) -> array:
+    """base_route_demand() of every route, flat origin x destination like DemandMatrix"""
+    values = array('d')
+    for origin, row in zip(cities, distances):
+        o = origin.population
+        values.extend(base_route_demand(o, destination.population, d) for destination, d in zip(cities, row))
+    return values
+
+
+def build_demand_matrix(cities: List[City], week: int, base_demand: array) -> DemandMatrix:
+    """Computes the demand of every route for a week in one pass over the catalog"""
+    n = len(cities)
+    values = array('q')
+    for i, origin in enumerate(cities):
+        row = [round(max(base * noise, 0))
+               for base, noise in zip(base_demand[i * n:(i + 1) * n], route_noise_row(origin, cities, week))]
+        row[i] = DemandMatrix.NO_DEMAND
+        values.extend(row)
+    return DemandMatrix(cities, week, values)
+
+
+DEMAND_CACHE_WEEKS = 8
+
+@lru_cache(maxsize=DEMAND_CACHE_WEEKS)
+def get_week_demand(week: int) -> DemandMatrix:
+    """Demand matrix of the catalog for a week, shared by every manager in this process.
+
+    Demand does not depend on the player, so all managers at the same week hold
+    the same object. It must be treated as read-only.
+    """
+    return build_demand_matrix(get_cities(), week, GAME_WORLD["base_demand"])
+
+
+def distribution_for_time(t: float) -> float:
+    """Share of a route's passengers that want to depart at local hour t"""
+    if t > 23:
+        t -= 24
+    elif t < 0:
+        t += 24
+    a = 0.4
+    d1 = 1.5
+    d2 = 4
+    d3 = 2
+    b1 = math.exp(-((t - 7) ** 2) / (2 * d1 ** 2)) # Früh peak
+    b2 = math.exp(-((t - 12) ** 2) / (2 * d2 ** 2)) # Mittag peak
+    b3 = math.exp(-((t - 18) ** 2) / (2 * d3 ** 2)) # Abend peak
+    return a/math.sqrt(math.pi)*(b1 + b2 + b3)+0.1
+
+
+def time_of_day_factor(exact_hours: float, timezone: float) -> float:
+    return distribution_for_time(exact_hours-timezone) + distribution_for_time((exact_hours - timezone - 1))
+
+
+@lru_cache(maxsize=None)
+def time_of_day_factors(timezone: float) -> array:
+    """time_of_day_factor() for every minute of the day, one table per timezone of the catalog"""
+    return array('d', (time_of_day_factor(m / 60, timezone) for m in range(Instant.MINUTES_PER_DAY)))
 
 
 def get_potential_passenger_demand(demand: int, hours: int, minutes: int, timezone: float) -> int:
-    def distribution_for_time(t):
-        if t > 23:
-            t -= 24
-        elif t < 0:
-            t += 24
-        a = 0.4
-        d1 = 1.5
-        d2 = 4
-        d3 = 2
-        b1 = math.exp(-((t - 7) ** 2) / (2 * d1 ** 2)) # Früh peak
-        b2 = math.exp(-((t - 12) ** 2) / (2 * d2 ** 2)) # Mittag peak
-        b3 = math.exp(-((t - 18) ** 2) / (2 * d3 ** 2)) # Abend peak
-        return a/math.sqrt(math.pi)*(b1 + b2 + b3)+0.1
     total_minutes = hours * 60 + minutes
-    exact_hours = total_minutes / 60
-    potential_demand = demand * (distribution_for_time(exact_hours-timezone) + distribution_for_time((exact_hours - timezone - 1))) + 0.2
+    if isinstance(total_minutes, int) and 0 <= total_minutes < Instant.MINUTES_PER_DAY:
+        factor = time_of_day_factors(timezone)[total_minutes]
+    else:
+        factor = time_of_day_factor(total_minutes / 60, timezone)
+    potential_demand = demand * factor + 0.2
     return round(potential_demand)
+
+
+def passenger_demand_curve(demand: int, timezone: float, step: int = 60, minutes: int = Instant.MINUTES_PER_DAY) -> List[int]:
+    """get_potential_passenger_demand() every step minutes of a day, or of the week with minutes=Instant.MINUTES_PER_WEEK.
+
+    The curve does not depend on the weekday, every day repeats the first one.
+    """
+    factors = time_of_day_factors(timezone)
+    return [round(demand * factors[m % Instant.MINUTES_PER_DAY] + 0.2) for m in range(0, minutes, step)]
@@ -0,0 +1,103 @@
+# search over the city catalog by name and short code, see CityIndex
+from functools import lru_cache
+from typing import Iterable, List, Optional, Set
+
+from main import City, get_cities
+
+# fuzzy matches need at least this share of trigrams in common with the query
+MIN_SIMILARITY = 0.3
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CityIndex:
+    """Prefix and trigram index over city names and short codes, built once per catalog.
+
+    search() returns catalog positions, best matches first:
+    names, words or short codes starting with the query, then names containing
+    it, then names that are merely similar (typos), most similar first.
+    Queries shorter than three characters get no similar matches.
+    """
+    def __init__(self, cities: List[City]):
+        self.cities = cities
+        self.keys = [(city.name.lower(), city.short.lower()) for city in cities]
+        self.prefixes: dict[str, List[int]] = {}
+        self.trigrams: dict[str, List[int]] = {}
+        self.key_trigrams: List[Set[str]] = []
+
+        for position, (name, short) in enumerate(self.keys):
+            prefixes = set()
+            for word in [name, short] + name.split():
+                prefixes.update(word[:length] for length in range(1, len(word) + 1))
+            for prefix in prefixes:
+                self.prefixes.setdefault(prefix, []).append(position)
+
+            grams = trigrams(name) | trigrams(short)
+            self.key_trigrams.append(grams)
+            for gram in grams:
+                self.trigrams.setdefault(gram, []).append(position)
+
+    def search(self, query: str) -> List[int]:
+        query = " ".join(query.lower().split())
+        if not query:
+            return list(range(len(self.cities)))
+
+        results = list(self.prefixes.get(query, []))
+        seen = set(results)
+        if len(query) < 3:
+            # too short for trigrams, a scan over the catalog is just as quick
+            results.extend(position for position, (name, _) in enumerate(self.keys)
+                           if position not in seen and query in name)
+            return results
+
+        # every city sharing a trigram with the query is a candidate
+        query_grams = trigrams(query)
+        shared: dict[int, int] = {}
+        for gram in query_grams:
+            for position in self.trigrams.get(gram, ()):
+                if position not in seen:
+                    shared[position] = shared.get(position, 0) + 1
+
+        containing = [position for position in sorted(shared) if query in self.keys[position][0]]
+        results.extend(containing)
+        seen.update(containing)
+
+        similar = []
+        for position, count in shared.items():
+            if position in seen:
+                continue
+            similarity = count / len(query_grams | self.key_trigrams[position])
+            if similarity >= MIN_SIMILARITY:
+                similar.append((similarity, position))
+        similar.sort(key=lambda match: (-match[0], match[1]))
+        results.extend(position for _, position in similar)
+        return results
+
+
+@lru_cache(maxsize=1)
+def get_city_index() -> CityIndex:
+    return CityIndex(get_cities())
+
+
+def search_cities(query: str = "", hub_shorts: Optional[Set[str]] = None, hubs: Optional[bool] = None,
+                  min_population: Optional[int] = None, max_population: Optional[int] = None,
+                  near: Optional[City] = None, max_distance: Optional[float] = None) -> List[City]:
+    """Cities matching query in relevance order, narrowed down by the given filters.
+
+    hubs=True keeps only cities in hub_shorts, hubs=False only the others.
+    max_distance is in km from near.
+    """
+    index = get_city_index()
+    cities: Iterable[City] = (index.cities[position] for position in index.search(query))
+    if hubs is not None:
+        cities = (city for city in cities if (city.short in hub_shorts) == hubs)
+    if min_population is not None:
+        cities = (city for city in cities if city.population >= min_population)
+    if max_population is not None:
+        cities = (city for city in cities if city.population <= max_population)
+    if near is not None and max_distance is not None:
+        cities = (city for city in cities if near.distance_to(city) <= max_distance)
+    return list(cities)
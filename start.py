@@ -1,7 +1,11 @@
 # run command to start venv and python app.py with python
 import os
+from dotenv import load_dotenv
 
-os.system("redis-server")
+# self-hosted games are saved in a local sqlite file, so no redis server is needed,
+# unless .env or the environment already points to a storage, e.g. an existing REDIS_URL
+load_dotenv()
+if not os.getenv("STORAGE_URL") and not os.getenv("REDIS_URL"):
+    os.environ["STORAGE_URL"] = "sqlite:///flight.sqlite3"
 os.system("source .venv/bin/activate")
 os.system("python app.py")
- 
\ No newline at end of file
@@ -0,0 +1,337 @@
+# where games are kept: redis for the hosted version, sqlite for self-hosting, memory for tests and benchmarks
+#   STORAGE_URL=redis://...            (falls back to REDIS_URL)
+#   STORAGE_URL=sqlite:///flight.sqlite3
+#   STORAGE_URL=memory://
+import os, sqlite3, threading
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+import redis
+
+from main import AirlineManager
+from codec import decode_manager, encode_sections, decode_sections
+
+KEY_PREFIX = "game:"
+VERSION_FIELD = "version" # bumped on every save, see GameStore.save_many
+
+
+class ConflictError(Exception):
+    """The game was saved by someone else since it was loaded, args are the user_ids of those games"""
+
+
+def game_key(user_id: str) -> str:
+    return f"{KEY_PREFIX}{user_id}"
+
+
+class GameStore:
+    """Keeps every game as a set of named fields, see AirlineManager.SECTIONS.
+
+    Next to its sections every game has a version field. Saves only go through
+    if the version is still the one the game was loaded at, so concurrent
+    requests cannot silently overwrite each other.
+
+    Backends implement read_fields, write_fields, delete and user_ids, batching
+    the work for several games into as few round trips as they can.
+    """
+
+    def read_fields(self, user_ids: List[str]) -> list:
+        """Per user: a dict of fields (str names), the bytes of a game stored as one blob, or None"""
+        raise NotImplementedError
+
+    def read_version(self, user_id: str) -> Optional[int]:
+        """Stored version of the game without loading it, None if there is no game"""
+        stored = self.read_fields([user_id])[0]
+        if not stored:
+            return None
+        return 0 if isinstance(stored, bytes) else int(stored.get(VERSION_FIELD, 0))
+
+    def write_fields(self, changes: List[Tuple[str, dict, bool, int]]):
+        """Writes (user_id, fields, replace, version) changes, all or none of them.
+
+        replace drops all other fields of that game. Raises ConflictError with every game
+        whose stored version is not version anymore, otherwise stores version + 1.
+        """
+        raise NotImplementedError
+
+    def delete(self, user_id: str):
+        raise NotImplementedError
+
+    def user_ids(self, batch_size: int = 100) -> Iterator[str]:
+        raise NotImplementedError
+
+    def load(self, user_id: str) -> Optional[AirlineManager]:
+        return self.load_many([user_id])[0]
+
+    def load_many(self, user_ids: List[str]) -> List[Optional[AirlineManager]]:
+        managers = []
+        for stored in self.read_fields(user_ids):
+            if not stored:
+                managers.append(None)
+            elif isinstance(stored, bytes):
+                # game saved as a single blob before it was split into fields
+                manager = decode_manager(stored)
+                manager.mark_all_dirty()
+                managers.append(manager)
+            else:
+                version = int(stored.pop(VERSION_FIELD, 0))
+                manager = decode_sections(stored)
+                manager.version = version
+                managers.append(manager)
+        return managers
+
+    def save(self, user_id: str, manager: AirlineManager):
+        self.save_many([(user_id, manager)])
+
+    def save_many(self, games: List[Tuple[str, AirlineManager]]):
+        """Writes the changed sections of every game, a fully changed game replaces the stored one.
+
+        Raises ConflictError, without saving anything, if one of the games was
+        saved by someone else since it was loaded. The others can be saved again without them.
+        """
+        changed = [(user_id, manager) for user_id, manager in games if manager.dirty]
+        if not changed:
+            return
+        self.write_fields([(user_id, encode_sections(manager, manager.dirty), manager.dirty.issuperset(AirlineManager.SECTIONS), manager.version)
+                           for user_id, manager in changed])
+        for _, manager in changed:
+            manager.dirty.clear()
+            manager.version += 1
+
+
+class RedisStore(GameStore):
+    def __init__(self, url: str, max_connections: int = 10, timeout: float = 5.0):
+        self.pool = redis.ConnectionPool.from_url(url, max_connections=max_connections,
+                                                  socket_timeout=timeout, socket_connect_timeout=timeout,
+                                                  health_check_interval=30)
+        self.r = redis.Redis(connection_pool=self.pool)
+
+    def read_fields(self, user_ids):
+        pipe = self.r.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hgetall(game_key(user_id))
+        replies = pipe.execute(raise_on_error=False)
+
+        stored = []
+        for user_id, reply in zip(user_ids, replies):
+            if isinstance(reply, redis.exceptions.ResponseError):
+                # WRONGTYPE: still a single blob
+                stored.append(self.r.get(game_key(user_id)))
+            elif isinstance(reply, Exception):
+                raise reply
+            else:
+                stored.append({name.decode(): value for name, value in reply.items()} or None)
+        return stored
+
+    def read_version(self, user_id):
+        pipe = self.r.pipeline(transaction=False)
+        pipe.exists(game_key(user_id))
+        pipe.hget(game_key(user_id), VERSION_FIELD)
+        exists, version = pipe.execute(raise_on_error=False)
+        if not exists:
+            return None
+        if isinstance(version, redis.exceptions.ResponseError):
+            return 0 # single blob, older than versioning
+        if isinstance(version, Exception):
+            raise version
+        return int(version or 0)
+
+    def _stored_version(self, pipe, key: str) -> int:
+        try:
+            return int(pipe.hget(key, VERSION_FIELD) or 0)
+        except redis.exceptions.ResponseError:
+            return 0 # single blob, older than versioning
+
+    def write_fields(self, changes):
+        keys = [game_key(user_id) for user_id, *_ in changes]
+        with self.r.pipeline() as pipe:
+            try:
+                # WATCH makes EXEC fail if any of the games is written after the version check
+                pipe.watch(*keys)
+                conflicts = [user_id for key, (user_id, _, _, version) in zip(keys, changes)
+                             if self._stored_version(pipe, key) != version]
+                if conflicts:
+                    raise ConflictError(*conflicts)
+                pipe.multi()
+                for key, (_, fields, replace, version) in zip(keys, changes):
+                    if replace:
+                        pipe.delete(key) # also replaces games stored as one blob
+                    pipe.hset(key, mapping={**fields, VERSION_FIELD: version + 1})
+                pipe.execute()
+            except redis.WatchError:
+                # find out which games were written meanwhile, all of them if that cannot be told
+                conflicts = [user_id for key, (user_id, _, _, version) in zip(keys, changes)
+                             if self._stored_version(self.r, key) != version]
+                raise ConflictError(*(conflicts or [user_id for user_id, *_ in changes]))
+
+    def delete(self, user_id):
+        self.r.delete(game_key(user_id))
+
+    def user_ids(self, batch_size=100):
+        for key in self.r.scan_iter(match=f"{KEY_PREFIX}*", count=batch_size):
+            yield key.decode()[len(KEY_PREFIX):]
+
+
+class MemoryStore(GameStore):
+    """Games in a dict of this process, lost on restart"""
+    def __init__(self):
+        self.games: dict[str, dict[str, bytes]] = {}
+        self.lock = threading.Lock()
+
+    def read_fields(self, user_ids):
+        with self.lock:
+            return [dict(self.games[user_id]) if user_id in self.games else None for user_id in user_ids]
+
+    def read_version(self, user_id):
+        with self.lock:
+            if user_id not in self.games:
+                return None
+            return int(self.games[user_id].get(VERSION_FIELD, 0))
+
+    def write_fields(self, changes):
+        with self.lock:
+            conflicts = [user_id for user_id, _, _, version in changes
+                         if int(self.games.get(user_id, {}).get(VERSION_FIELD, 0)) != version]
+            if conflicts:
+                raise ConflictError(*conflicts)
+            for user_id, fields, replace, version in changes:
+                if replace or user_id not in self.games:
+                    self.games[user_id] = {}
+                self.games[user_id].update(fields)
+                self.games[user_id][VERSION_FIELD] = str(version + 1).encode()
+
+    def delete(self, user_id):
+        with self.lock:
+            self.games.pop(user_id, None)
+
+    def user_ids(self, batch_size=100):
+        with self.lock:
+            return iter(list(self.games))
+
+
+class SQLiteStore(GameStore):
+    """Games in a local sqlite file, for hosting the game yourself"""
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        self.connection().execute("CREATE TABLE IF NOT EXISTS game_fields ("
+                                  "user_id TEXT NOT NULL, field TEXT NOT NULL, value BLOB NOT NULL, "
+                                  "PRIMARY KEY (user_id, field))")
+
+    def connection(self) -> sqlite3.Connection:
+        # sqlite connections may not be shared between threads
+        db = getattr(self.local, "db", None)
+        if db is None:
+            # autocommit, transactions are opened explicitly where they are needed
+            db = self.local.db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def read_fields(self, user_ids):
+        stored = {user_id: {} for user_id in user_ids}
+        placeholders = ",".join("?" * len(user_ids))
+        rows = self.connection().execute(
+            f"SELECT user_id, field, value FROM game_fields WHERE user_id IN ({placeholders})", user_ids)
+        for user_id, field, value in rows:
+            stored[user_id][field] = value
+        return [stored[user_id] or None for user_id in user_ids]
+
+    def read_version(self, user_id):
+        fields, version = self.connection().execute(
+            "SELECT COUNT(*), MAX(CASE WHEN field = ? THEN value END) FROM game_fields WHERE user_id = ?",
+            (VERSION_FIELD, user_id)).fetchone()
+        if not fields:
+            return None
+        return int(version or 0)
+
+    def write_fields(self, changes):
+        db = self.connection()
+        # IMMEDIATE takes the write lock before the version check, not after it
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            conflicts = []
+            for user_id, _, _, version in changes:
+                row = db.execute("SELECT value FROM game_fields WHERE user_id = ? AND field = ?",
+                                 (user_id, VERSION_FIELD)).fetchone()
+                if int(row[0] if row else 0) != version:
+                    conflicts.append(user_id)
+            if conflicts:
+                raise ConflictError(*conflicts)
+            for user_id, fields, replace, version in changes:
+                if replace:
+                    db.execute("DELETE FROM game_fields WHERE user_id = ?", (user_id,))
+                rows = [(user_id, field, value) for field, value in fields.items()]
+                rows.append((user_id, VERSION_FIELD, str(version + 1).encode()))
+                db.executemany("INSERT OR REPLACE INTO game_fields (user_id, field, value) VALUES (?, ?, ?)", rows)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def delete(self, user_id):
+        self.connection().execute("DELETE FROM game_fields WHERE user_id = ?", (user_id,))
+
+    def user_ids(self, batch_size=100):
+        rows = self.connection().execute("SELECT DISTINCT user_id FROM game_fields").fetchall()
+        return iter([user_id for (user_id,) in rows])
+
+
+class ManagerCache:
+    """Hydrated games of this worker, reused as long as their stored version is unchanged.
+
+    Checking the version is a single small read instead of decoding the whole
+    game. Cached managers are shared between requests, so only use them for
+    requests that do not change the game.
+    """
+    def __init__(self, store: GameStore, size: int = 256):
+        self.store = store
+        self.size = size
+        self.managers: OrderedDict[str, AirlineManager] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load(self, user_id: str, version: Optional[int] = None) -> Optional[AirlineManager]:
+        """The game of user_id, version is the stored version if the caller just read it"""
+        if version is None:
+            version = self.store.read_version(user_id)
+        if version is None:
+            self.discard(user_id)
+            return None
+        with self.lock:
+            manager = self.managers.get(user_id)
+            if manager is not None and manager.version == version:
+                self.managers.move_to_end(user_id)
+                return manager
+        manager = self.store.load(user_id)
+        if manager is not None:
+            self.put(user_id, manager)
+        return manager
+
+    def put(self, user_id: str, manager: AirlineManager):
+        """Caches a manager as loaded or saved, games with unsaved changes are left out"""
+        if manager.dirty:
+            self.discard(user_id)
+            return
+        with self.lock:
+            self.managers[user_id] = manager
+            self.managers.move_to_end(user_id)
+            while len(self.managers) > self.size:
+                self.managers.popitem(last=False)
+
+    def discard(self, user_id: str):
+        with self.lock:
+            self.managers.pop(user_id, None)
+
+
+def create_store(url: Optional[str] = None) -> GameStore:
+    url = url or os.getenv("STORAGE_URL") or os.getenv("REDIS_URL")
+    if not url:
+        raise ValueError("Kein Speicher konfiguriert, STORAGE_URL oder REDIS_URL setzen")
+    if url.startswith("memory://"):
+        return MemoryStore()
+    if url.startswith("sqlite://"):
+        path = url[len("sqlite:///"):]
+        if path in ("", ":memory:"):
+            # every thread has its own connection, so each would see its own empty database
+            raise ValueError("sqlite:// braucht eine Datei, z.B. sqlite:///flight.sqlite3, für Tests memory:// nehmen")
+        return SQLiteStore(path)
+    return RedisStore(url,
+                      max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 10)),
+                      timeout=float(os.getenv("REDIS_TIMEOUT", 5)))
@@ -0,0 +1,147 @@
+# advance or recompute every stored game at once, e.g. after a balance change
+#   python tick.py advance --workers 4
+#   python tick.py recompute --storage-url sqlite:///flight.sqlite3
+import argparse, os, time
+from multiprocessing import Pool
+from dotenv import load_dotenv
+
+from storage import ConflictError, GameStore, create_store
+
+ACTIONS = ("advance", "recompute")
+MAX_SAVE_ATTEMPTS = 3 # per game, a game is reloaded and ticked again when its player saved meanwhile
+
+_worker_store = None
+
+
+def tick_game(manager, action: str):
+    if action == "advance":
+        manager.advance_week()
+    else:
+        # rebook all flights with the current rules, hubs are rebuilt from their level on load anyway
+        manager.recalculate_flights()
+        manager.mark_all_dirty()
+
+
+def tick_batch(store: GameStore, user_ids: list, action: str) -> dict:
+    """Loads, ticks and saves a batch of games, batched into one read and one write.
+
+    Games a player saved meanwhile are left out of the write and reloaded and
+    ticked again, the rest of the batch is saved without waiting for them.
+    """
+    stats = {"games": 0, "skipped": 0, "failed": 0}
+    pending = list(user_ids)
+    for attempt in range(MAX_SAVE_ATTEMPTS):
+        ticked = _tick_games(store, pending, action, stats)
+        pending = _save_ticked(store, ticked)
+        stats["games"] += len(ticked) - len(pending)
+        if not pending:
+            return stats
+        print(f"{', '.join(pending)}: gleichzeitig geändert, Versuch {attempt + 1}/{MAX_SAVE_ATTEMPTS}")
+    stats["failed"] += len(pending)
+    return stats
+
+
+def _tick_games(store: GameStore, user_ids: list, action: str, stats: dict) -> list:
+    """(user_id, manager) of every game that could be ticked, the others are counted in stats"""
+    ticked = []
+    for user_id, manager in zip(user_ids, store.load_many(user_ids)):
+        if manager is None:
+            continue
+        try:
+            tick_game(manager, action)
+        except ValueError as e:
+            # invalid flight plan, the player has to fix it first
+            print(f"{user_id}: übersprungen ({e})")
+            stats["skipped"] += 1
+            continue
+        except Exception as e:
+            print(f"{user_id}: Fehler ({e!r})")
+            stats["failed"] += 1
+            continue
+        ticked.append((user_id, manager))
+    return ticked
+
+
+def _save_ticked(store: GameStore, ticked: list) -> list:
+    """Saves the ticked games, returns the user_ids of those that were changed meanwhile"""
+    conflicts = []
+    while ticked:
+        try:
+            store.save_many(ticked)
+            break
+        except ConflictError as e:
+            # nothing was written, write again without the changed games
+            changed = set(e.args)
+            conflicts.extend(user_id for user_id, _ in ticked if user_id in changed)
+            ticked = [(user_id, manager) for user_id, manager in ticked if user_id not in changed]
+    return conflicts
+
+
+def _init_worker(storage_url: str):
+    global _worker_store
+    _worker_store = create_store(storage_url)
+
+
+def _tick_batch_in_worker(job) -> dict:
+    user_ids, action = job
+    return tick_batch(_worker_store, user_ids, action)
+
+
+def batches(store: GameStore, batch_size: int):
+    batch = []
+    for user_id in store.user_ids(batch_size):
+        batch.append(user_id)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def tick_all(storage_url: str, action: str, workers: int, batch_size: int, store: GameStore = None) -> dict:
+    """Ticks every game. With workers=0 everything runs in this process on store, if given"""
+    if workers and storage_url and storage_url.startswith("memory://"):
+        raise ValueError("memory:// gibt es nur in diesem Prozess, dafür --workers 0 angeben")
+    if store is None:
+        store = create_store(storage_url)
+    totals = {"games": 0, "skipped": 0, "failed": 0}
+    started = time.perf_counter()
+
+    if workers == 0:
+        results = (tick_batch(store, user_ids, action) for user_ids in batches(store, batch_size))
+        for stats in results:
+            for name, count in stats.items():
+                totals[name] += count
+    else:
+        # list the games first, so workers never write while the scan is still running
+        jobs = [(user_ids, action) for user_ids in batches(store, batch_size)]
+        with Pool(workers, initializer=_init_worker, initargs=(storage_url,)) as pool:
+            for stats in pool.imap_unordered(_tick_batch_in_worker, jobs):
+                for name, count in stats.items():
+                    totals[name] += count
+
+    totals["seconds"] = time.perf_counter() - started
+    return totals
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Alle gespeicherten Spiele auf einmal weiterrechnen")
+    parser.add_argument("action", choices=ACTIONS, help="advance: eine Woche weiter, recompute: Flüge neu berechnen")
+    parser.add_argument("--storage-url", default=os.getenv("STORAGE_URL") or os.getenv("REDIS_URL"),
+                        help="redis://..., sqlite:///datei oder memory:// (nur mit --workers 0)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="0 = alles im Hauptprozess")
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    try:
+        totals = tick_all(args.storage_url, args.action, args.workers, args.batch_size)
+    except ValueError as e:
+        parser.error(str(e))
+    rate = totals["games"] / totals["seconds"] if totals["seconds"] else 0
+    print(f"{totals['games']} Spiele in {totals['seconds']:.2f}s ({rate:.1f} Spiele/s), "
+          f"{totals['skipped']} übersprungen, {totals['failed']} fehlgeschlagen")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# precompiled game world: cities, plane models and the route tables in one binary file,
+# so a cold start reads one file instead of parsing cities.csv and every plane json
+#   python world.py     (re)builds world.snapshot, commit it together with changes to the sources
+# world.snapshot is checked in, deployments like Vercel cannot write it at runtime.
+# It is only used while the hash of the sources matches (mtimes do not survive a git checkout),
+# otherwise the world is compiled from the sources, as before, and the snapshot rewritten,
+# or a copy in the temp directory if the checkout is read-only
+import hashlib, os, sys, tempfile
+from array import array
+from pathlib import Path
+from typing import List, Union
+import msgspec
+
+from main import City, PlaneModel, load_cities, load_models, build_distance_matrix, build_base_demand, build_lookup
+
+SNAPSHOT_PATH = os.getenv("WORLD_SNAPSHOT", "world.snapshot")
+# bump whenever the tables below are computed differently, e.g. a new demand formula
+WORLD_VERSION = 1
+
+# the plane every new airline starts with, it has no file in planes/
+STARTER_MODEL = ("Dash 8 Q200", 39, 2000, 3, 50000, 200, 2)
+
+
+class CityRecord(msgspec.Struct, array_like=True):
+    name: str
+    population: int
+    x: float
+    y: float
+    short: str
+    timezone: float
+
+
+# numbers stay int or float exactly as written in the plane's json
+Number = Union[int, float]
+
+
+class ModelRecord(msgspec.Struct, array_like=True):
+    name: str
+    capacity: Number
+    range: Number
+    velocity: Number
+    price: Number
+    maintenance: Number
+    pilots: Number
+
+
+class WorldSnapshot(msgspec.Struct, array_like=True):
+    source_hash: str
+    cities: List[CityRecord]
+    models: List[ModelRecord]
+    distances: bytes # array('d'), origin x destination
+    base_demand: bytes # array('d'), origin x destination
+
+
+def source_files() -> List[Path]:
+    return [Path("cities.csv")] + sorted(Path("planes").glob("**/*.json"))
+
+
+def source_hash() -> str:
+    """Hash of everything the world is built from, a snapshot with another hash is stale"""
+    # the tables are stored in native byte order
+    digest = hashlib.blake2b(f"{WORLD_VERSION} {sys.byteorder}".encode(), digest_size=16)
+    for path in source_files():
+        digest.update(path.as_posix().encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def compile_world() -> dict:
+    cities = load_cities()
+    models = [PlaneModel(*STARTER_MODEL)] + load_models()
+    distances = build_distance_matrix(cities)
+    return {
+        "cities": cities,
+        "models": models,
+        "distances": distances,
+        "base_demand": build_base_demand(cities, distances),
+    }
+
+
+def encode_world(world: dict, source_hash: str) -> bytes:
+    snapshot = WorldSnapshot(
+        source_hash=source_hash,
+        cities=[CityRecord(c.name, c.population, c.x, c.y, c.short, c.timezone) for c in world["cities"]],
+        models=[ModelRecord(m.name, m.capacity, m.range, m.velocity, m.price, m.maintenance, m.pilots) for m in world["models"]],
+        distances=array('d', (d for row in world["distances"] for d in row)).tobytes(),
+        base_demand=world["base_demand"].tobytes(),
+    )
+    return msgspec.msgpack.encode(snapshot)
+
+
+def decode_world(snapshot: WorldSnapshot) -> dict:
+    cities = [City(c.name, c.population, c.x, c.y, c.short, c.timezone, index=i) for i, c in enumerate(snapshot.cities)]
+    distances = array('d')
+    distances.frombytes(snapshot.distances)
+    base_demand = array('d')
+    base_demand.frombytes(snapshot.base_demand)
+    n = len(cities)
+    return {
+        "cities": cities,
+        "models": [PlaneModel(*msgspec.structs.astuple(m)) for m in snapshot.models],
+        "distances": [distances[i * n:(i + 1) * n].tolist() for i in range(n)],
+        "base_demand": base_demand,
+    }
+
+
+def read_snapshot(path: str, expected_hash: str):
+    try:
+        with open(path, "rb") as f:
+            snapshot = msgspec.msgpack.decode(f.read(), type=WorldSnapshot)
+    except (OSError, msgspec.DecodeError, msgspec.ValidationError):
+        return None
+    return snapshot if snapshot.source_hash == expected_hash else None
+
+
+def write_snapshot(world: dict, path: str, source_hash: str):
+    # write next to it first, so a parallel start never reads half a file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(encode_world(world, source_hash))
+    os.replace(tmp, path)
+
+
+def fallback_path(source_hash: str) -> str:
+    """Where a snapshot goes when its path is read-only, one file per version of the sources"""
+    return os.path.join(tempfile.gettempdir(), f"world-{source_hash}.snapshot")
+
+
+def load_world(path: str = SNAPSHOT_PATH) -> dict:
+    """Everything GAME_WORLD holds, from the snapshot if it is up to date"""
+    expected_hash = source_hash()
+    snapshot = read_snapshot(path, expected_hash)
+    if snapshot is None:
+        snapshot = read_snapshot(fallback_path(expected_hash), expected_hash)
+    if snapshot is not None:
+        world = decode_world(snapshot)
+    else:
+        world = compile_world()
+        for target in (path, fallback_path(expected_hash)):
+            try:
+                write_snapshot(world, target, expected_hash)
+                break
+            except OSError:
+                continue # read-only, try the next one or compile again next start
+
+    world["cities_by_short"] = build_lookup(world["cities"], lambda c: c.short)
+    world["city_lookup"] = build_lookup(world["cities"], lambda c: c.name.lower(), lambda c: c.short.lower())
+    world["models_by_name"] = build_lookup(world["models"], lambda m: m.name)
+    world["model_lookup"] = build_lookup(world["models"], lambda m: m.name.lower())
+    return world
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else SNAPSHOT_PATH
+    world = compile_world()
+    write_snapshot(world, path, source_hash())
+    print(f"{path}: {len(world['cities'])} Städte, {len(world['models'])} Flugzeugmodelle")
+
+
+if __name__ == "__main__":
+    main()